@@ -56,9 +56,11 @@ def deleteVersionInStore(**params):
 def getVersionFromStore(**params):
     '''
     VERSIONの全データを取得
+    limit: 0でなければ新しい方からlimit件だけでもよい
     返値: (boolean, versions)
     '''
     version = params.get('version')
+    limit = params.get('limit', 0)
     client = params.get('client')
     if not client:
         return (False, 'No Exist VERSION client.')
@@ -21,9 +21,15 @@ import bz2
 import socket
 from datetime import datetime, UTC
 from calendar import timegm
-from time import sleep
+from time import sleep, monotonic
 from concurrent import futures
-import inspect
+import threading
+import queue
+import random
+import heapq
+import hashlib
+import zlib
+import codecs
 import argparse
 import shutil
 import textwrap
@@ -64,12 +70,119 @@ ZC_NOTICE = 'Email'
 ZC_NOTICE_USER = ZABBIX_SUPER_USER
 ZC_NOTICE_TO = 'alert@example.com'
 ZC_DEFAULT_STORE = 'file'
+# ストアのデータの圧縮形式、bz2は以前の形式（ヘッダーなし）
+ZC_DEFAULT_CODEC = 'bz2'
+# 圧縮データのヘッダー（+コーデック番号1バイト）
+ZC_CODEC_MAGIC = b'ZC\x00'
+# 辞書付き圧縮、コーデック番号のフラグ（+辞書のCRC32の4バイト）、辞書のサイズ、学習に使うアイテム数、zlibの辞書に並べる断片のサイズ
+ZC_CODEC_DICT_FLAG = 0x80
+ZC_CODEC_DICT_BYTES = 32 * 1024
+ZC_CODEC_DICT_SAMPLES = 2000
+ZC_CODEC_DICT_PIECE = 512
 ZC_NO_NOTICE_ROLE = ['replica']
 ZC_COMPLETE = (True, 'Complete.')
 ZC_TEMPLATE_SEPARATE = 100
+ZC_API_BATCH_SIZE = 100
+ZC_SEPARATE_MIN = 1
+ZC_SEPARATE_MAX = 1000
+ZC_SEPARATE_BYTES = 8 * 1024 * 1024
+ZC_SEPARATE_SEC = 30
+# 区切り数を減らす失敗（タイムアウト、サイズ超過、応答なし）
+# HTTPのステータスコード（例外のcode/response.status_code、メッセージの"HTTP Error 504"など）
+ZC_SEPARATE_OVERLOAD_STATUS = [413, 502, 503, 504]
+# エラーメッセージの正規表現（小文字で比較）、IDや名前の数字に一致しないように単語で区切る
+ZC_SEPARATE_OVERLOAD = [
+    r'\btimed out\b',
+    r'\btime ?out\b',
+    r'\btoo large\b',
+    r'\bhttp(?: error)?:? ?(?:413|502|503|504)\b',
+    r'\bstatus(?: code)?:? ?(?:413|502|503|504)\b',
+    r'\ballowed memory size\b',
+    r'\bno result\b',
+    r'\bno response\b',
+    r'\bempty response\b',
+    r'\bremote end closed\b',
+    r'\bconnection (?:aborted|reset)\b',
+]
 ZC_NODE_ID = 'ZC_NODE_ID'
+# 書き込むと他のメソッドのデータも変わるもの {書き込んだメソッド: [一緒に変わるメソッド]}
+# methodParametersのselect*/出力のID（参照先の作成、削除、名前変更で変わる）とインポートのリンクから作る
+# hostinterface -> hostのinterfaces
+# host/hostgroup -> maintenanceのselectHosts/selectGroups、actionの条件とオペレーション
+# hostgroup/templategroup -> usergroupのselectRights（6.2以降Host/TemplateGroupRights）、scriptのgroupid
+# template/hostgroup/templategroup（インポート、削除） -> host/templateのリンク、グループ
+# mediatype/usergroup/role/userdirectory -> userのselectMedias/selectUsrgrps/roleid/userdirectoryid
+# mediatype/user/usergroup/script -> actionのオペレーション、usergroup -> scriptのusrgrpid
+# proxy/proxygroup -> host、druleのproxy_hostid、actionの条件
+# userdirectory/mfa -> usergroupのuserdirectoryid/mfaid、drule -> actionの条件
+ZC_WRITTEN_DEPENDS = {
+    'hostinterface': ['host'],
+    'host': ['maintenance', 'action'],
+    'hostgroup': ['host', 'maintenance', 'usergroup', 'script', 'action'],
+    'templategroup': ['template', 'usergroup'],
+    'template': ['host', 'action'],
+    'mediatype': ['user', 'action'],
+    'user': ['action'],
+    'usergroup': ['user', 'script', 'action'],
+    'script': ['action'],
+    'role': ['user'],
+    'userdirectory': ['user', 'usergroup'],
+    'mfa': ['usergroup'],
+    'proxy': ['host', 'drule', 'action'],
+    'proxygroup': ['proxy', 'host'],
+    'drule': ['action'],
+}
 ZC_FILE_STORE = ['/var/lib/zabbix', 'Documents']
+# ファイルストアの分割配置、マニフェストのファイル名、シャードの最大アイテム数、書き込み途中のディレクトリの接尾辞
+ZC_FILE_MANIFEST = 'manifest.json'
+ZC_FILE_SHARD_ITEMS = 1000
+ZC_FILE_WRITING = '.__WRITING__'
+# ファイルストアのストリーム読み込みで1回に読むバイト数
+ZC_FILE_READ_BYTES = 256 * 1024
+# Redisのscan/hscanで1回に取得する件数の目安
+ZC_REDIS_SCAN_COUNT = 1000
+# RedisのVERSION_IDの索引（UNIXTIMEをスコアにしたZSET）のキー
+ZC_REDIS_VERSION_INDEX = '__ZC_VERSION_INDEX__'
+# RedisのHSET1回でまとめるフィールド数
+ZC_REDIS_HSET_FIELDS = 100
+# バージョンの圧縮辞書のキーの接尾辞
+ZC_REDIS_DATA_DICT = ':__DICT__'
+# 書き込み途中のDATAのキーの接尾辞（アトミック書き込み用）
+ZC_REDIS_WRITING = ':__WRITING__'
+# DATAのメソッド/名前 -> DATA_IDの索引のキーの接尾辞
+ZC_REDIS_DATA_INDEX = ':__INDEX__'
+# Redisの分散配置（Redis Cluster対応）のキーの接頭辞と分散数
+ZC_REDIS_SHARD_VERSION = 'ZC_VERSION:'
+ZC_REDIS_SHARD_DATA = 'ZC_DATA:'
+ZC_REDIS_SHARD_BUCKETS = 16
+# DynamoDBのBatchWriteItemの1回の上限件数、並列の書き込み数
+ZC_DYDB_BATCH_SIZE = 25
+ZC_DYDB_WRITERS = 4
+# DynamoDBのスロットリング時の待機秒数の基準（2^再試行回数倍、上限dydbBackoffMax）
+ZC_DYDB_BACKOFF = 0.05
+ZC_DYDB_THROTTLE_ERRORS = ['ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded']
+# DynamoDBのScanの並列セグメント数
+ZC_DYDB_SEGMENTS = 4
+# DynamoDBのVERSIONのGSI用の固定パーティションキー（全バージョン同じ値、UNIXTIMEをソートキーにする）
+ZC_DYDB_VERSION_GROUP = 'VERSION_GROUP'
+# DynamoDBのDATAのメタデータ（DATA以外）の属性
+ZC_DYDB_DATA_META = ['VERSION_ID', 'DATA_ID', 'METHOD', 'NAME', 'CHUNKS']
+# DynamoDBの1アイテム400KB制限に対して、圧縮後のDATAを分割するサイズ
+ZC_DYDB_ITEM_BYTES = 350 * 1024
+# 分割したDATAのソートキーの接頭辞（UUIDより後ろに並ぶようにして、通常のアイテムのQueryで読まない）
+ZC_DYDB_CHUNK_PREFIX = '~'
+# DynamoDBのバージョンの圧縮辞書のソートキー（通常のアイテムのQueryで読まない）
+ZC_DYDB_DICT_KEY = '~DICT'
+# DynamoDBのBatchGetItemの1回の件数（応答の16MB制限に分割サイズで収まる数）
+ZC_DYDB_GET_SIZE = 40
 ZC_VERSION_CODE = '{$ZC_VERSION}'
+ZC_DIGEST_CODE = '{$ZC_DIGEST}'
+# トリガー式からホスト（テンプレート）名を取り出す正規表現
+# 5.4以降: func(/host/key,...)、5.4未満: {host:key.func()}（{$MACRO}は除外）
+ZC_TRIGGER_HOST = {
+    5.4: re.compile(r'\(\s*/([^/]+)/'),
+    4.0: re.compile(r'\{([^{}$:][^{}:]*):'),
+}
 
 # 表示系
 SIZE = shutil.get_terminal_size()
@@ -294,6 +407,11 @@ class ZabbixCloneConfig():
         self.storeType = CONFIG.get('store_type', ZC_DEFAULT_STORE)
         if self.storeType == 'extend':
             self.storeType = CONFIG.get('extend_store', ZC_DEFAULT_STORE)
+        # ストアのデータの圧縮形式とレベル（Noneはコーデックのデフォルト）
+        self.storeCodec = CONFIG.get('store_codec', ZC_DEFAULT_CODEC)
+        self.storeCodecLevel = CONFIG.get('store_codec_level', None)
+        # バージョンごとに学習した辞書でアイテムを圧縮する（Redis/DynamoDB）
+        self.storeCodecDict = True if CONFIG.get('store_codec_dict', 'NO') == 'YES' else False
         # ストア接続情報
         self.storeConnect = CONFIG.get('store_connect', {})
         if self.storeType == 'dydb':
@@ -311,14 +429,21 @@ class ZabbixCloneConfig():
                         'store_endpoint',
                         self.storeConnect.get('aws_region', 'us-east-1')
                     ),
+                    # dydb_limit/dydb_wait（--store-limit/--store-interval）は書き込み容量の調整に置き換えたので非推奨、無視する
                     'dydbLimit': CONFIG.get(
                         'store_limit',
-                        self.storeConnect.get('dydb_limit', 10)
+                        self.storeConnect.get('dydb_limit', None)
                     ),
                     'dydbWait': CONFIG.get(
                         'store_interval',
-                        self.storeConnect.get('dydb_wait', 2)
+                        self.storeConnect.get('dydb_wait', None)
                     ),
+                    'dydbRetries': self.storeConnect.get('dydb_retries', 10),
+                    'dydbBackoffMax': self.storeConnect.get('dydb_backoff_max', 2),
+                    'dydbWcu': self.storeConnect.get('dydb_wcu', 0),
+                    'dydbWriters': self.storeConnect.get('dydb_writers', ZC_DYDB_WRITERS),
+                    'dydbSegments': self.storeConnect.get('dydb_segments', ZC_DYDB_SEGMENTS),
+                    'dydbVersionIndex': self.storeConnect.get('dydb_version_index', None),
                 }
             )
         elif self.storeType == 'redis':
@@ -335,7 +460,22 @@ class ZabbixCloneConfig():
                     'redisPassword': CONFIG.get(
                         'store_credential',
                         self.storeConnect.get('redis_password', None)
-                    )
+                    ),
+                    'redisChunk': CONFIG.get(
+                        'store_limit',
+                        self.storeConnect.get('redis_chunk', 1000)
+                    ),
+                    'redisAtomic': self.storeConnect.get('redis_atomic', 'NO') == 'YES',
+                    'redisCluster': self.storeConnect.get('redis_cluster', 'NO') == 'YES',
+                    'redisShard': self.storeConnect.get('redis_layout', 'single') == 'shard',
+                    'redisBuckets': self.storeConnect.get('redis_buckets', ZC_REDIS_SHARD_BUCKETS),
+                }
+            )
+        elif self.storeType == 'file':
+            self.storeConnect.update(
+                {
+                    'fileShard': self.storeConnect.get('file_layout', 'single') == 'shard',
+                    'fileShardItems': self.storeConnect.get('file_shard_items', ZC_FILE_SHARD_ITEMS),
                 }
             )
         elif self.storeType == 'direct':
@@ -412,7 +552,13 @@ class ZabbixCloneConfig():
         # checknowを実行する際の設定適用待機時間
         self.checknowWait = CONFIG.get('checknow_wait', 30)
         # 並列実行可能数
-        self.phpWorkerNum = int(CONFIG.get('php_work_num', PHP_WORKER_NUM))
+        self.phpWorkerNum = int(CONFIG.get('php_worker_num', CONFIG.get('php_work_num', PHP_WORKER_NUM)))
+        # API取得（get）の並列実行数、指定がなければphpWorkerNumと同じ
+        self.apiWorkerNum = int(CONFIG.get('api_worker_num', self.phpWorkerNum))
+        # API実行（create/update/delete）で配列にまとめる数
+        self.apiBatchSize = int(CONFIG.get('api_batch_size', ZC_API_BATCH_SIZE))
+        # host.create/updateを配列にまとめる数、指定がなければapiBatchSizeと同じ
+        self.hostBatchSize = int(CONFIG.get('host_batch_size', self.apiBatchSize))
         # DBダイレクト接続設定（Zabbix Server設定を使わない場合の設定）
         self.dbConnect = CONFIG.get('db_connect', {})
         if self.dbConnect:
@@ -444,10 +590,21 @@ class ZabbixCloneConfig():
         defSkip = 'YES' if self.role == 'worker' else 'NO'
         self.templateSkip = True if CONFIG.get('template_skip', defSkip) == 'YES' else False
         # テンプレートのエクスポート時の区切り数
-        self.templateSeparate = CONFIG.get('template_separate', ZC_TEMPLATE_SEPARATE)
+        self.templateSeparate = int(CONFIG.get('template_separate', ZC_TEMPLATE_SEPARATE))
+        # ホストのエクスポート時の区切り数、指定がなければテンプレートと同じ
+        self.hostSeparate = int(CONFIG.get('host_separate', self.templateSeparate))
+        # エクスポート/インポートの区切り数の自動調整範囲
+        # 1回のデータ量（バイト）と応答時間（秒）の目標値を超えないように区切り数を変える
+        self.separateMin = int(CONFIG.get('separate_min', ZC_SEPARATE_MIN))
+        self.separateMax = int(CONFIG.get('separate_max', ZC_SEPARATE_MAX))
+        self.separateBytes = int(CONFIG.get('separate_bytes', ZC_SEPARATE_BYTES))
+        self.separateSec = float(CONFIG.get('separate_sec', ZC_SEPARATE_SEC))
+        # 前回の適用から変更がなければ適用をスキップする
+        self.skipUnchanged = True if CONFIG.get('skip_unchanged', 'NO') == 'YES' else False
         # 強制初期化時の変更項目
         if self.forceInitialize:
             self.templateSkip = False
+            self.skipUnchanged = False
 
         return ZC_COMPLETE
 
@@ -519,10 +676,23 @@ class ZabbixCloneConfig():
             dispMessage.append('{}Configuration Export Skip Template: {}'.format(TAB, 'YES' if self.templateSkip else 'NO'))
             if self.templateSeparate != ZC_TEMPLATE_SEPARATE:
                 dispMessage.append(f'{TAB}Configuration Export Separate Count: {self.templateSeparate}')
+            if self.hostSeparate != self.templateSeparate:
+                dispMessage.append(f'{TAB}Configuration Export Separate Count(Host): {self.hostSeparate}')
         else:
             dispMessage.append('{}Configuration Import Skip Template: {}'.format(TAB, 'YES' if self.templateSkip else 'NO'))
+            dispMessage.append('{}Skip Unchanged Since Last Clone: {}'.format(TAB, 'YES' if self.skipUnchanged else 'NO'))
+        if self.separateMin != ZC_SEPARATE_MIN or self.separateMax != ZC_SEPARATE_MAX:
+            dispMessage.append(f'{TAB}Configuration Separate Count Range: {self.separateMin}-{self.separateMax}')
+        if self.separateBytes != ZC_SEPARATE_BYTES or self.separateSec != ZC_SEPARATE_SEC:
+            dispMessage.append(f'{TAB}Configuration Separate Target: {self.separateBytes}bytes/{self.separateSec}s')
         if self.phpWorkerNum != PHP_WORKER_NUM:
             dispMessage.append(f'{TAB}Number of Parallel Excution Create/Update Hosts: {self.phpWorkerNum}') 
+        if self.apiWorkerNum != self.phpWorkerNum:
+            dispMessage.append(f'{TAB}Number of Parallel Excution Get API: {self.apiWorkerNum}')
+        if self.apiBatchSize != ZC_API_BATCH_SIZE:
+            dispMessage.append(f'{TAB}Number of Objects per API Execution: {self.apiBatchSize}')
+        if self.hostBatchSize != self.apiBatchSize:
+            dispMessage.append(f'{TAB}Number of Hosts per API Execution: {self.hostBatchSize}')
 
         # ストア関連
         if self.storeType == 'dydb':
@@ -536,6 +706,11 @@ class ZabbixCloneConfig():
         else:
             storeType = f'Extend Store {self.storeType}'
         dispMessage.append(f'{TAB}Store Type: {storeType}')
+        if self.storeType != 'direct':
+            level = '' if self.storeCodecLevel is None else f' (level {self.storeCodecLevel})'
+            dispMessage.append(f'{TAB*2}Store Codec: {self.storeCodec}{level}')
+            if self.storeCodecDict:
+                dispMessage.append(f'{TAB*2}Store Codec Dictionary: YES')
         if self.storeType == 'dydb':
             if self.storeConnect.get('aws_region'):
                 region = self.storeConnect['aws_region']
@@ -644,15 +819,46 @@ class ZabbixCloneParameter():
                 'id': 'hostid',
                 'name': 'host',
                 'options': {
-                    'output': ['hostid', 'host'],
-                    'selectTags': ['tag', 'value']
+                    # 複製で書き込む項目、前回の適用からの変更の判定（checkDigestCode）に使う
+                    # 監視状態で変わる項目（available、maintenance_statusなど）は取らない
+                    'output': [
+                        'hostid',
+                        'host',
+                        'name',
+                        'status',
+                        'description',
+                        'proxy_hostid',
+                        'tls_connect',
+                        'tls_accept',
+                        'tls_issuer',
+                        'tls_subject',
+                        'ipmi_authtype',
+                        'ipmi_privilege',
+                        'ipmi_username'
+                    ],
+                    'selectTags': ['tag', 'value'],
+                    'selectInterfaces': ['type', 'main', 'useip', 'ip', 'dns', 'port', 'bulk'],
+                    'selectGroups': ['name'],
+                    'selectParentTemplates': ['host'],
+                    'selectMacros': ['macro', 'value'],
+                    'selectInventory': 'extend'
                 },
             },
             'template': {
                 'id': 'templateid',
                 'name': 'name',
                 'options': {
-                    'output': ['templateid', 'name'],
+                    # hostはテンプレートの技術名、リンクの解決に使う
+                    # リンク、マクロ、アイテムなどの数は前回の適用からの変更の判定（checkDigestCode）に使う
+                    'output': ['templateid', 'name', 'host'],
+                    'selectGroups': ['name'],
+                    'selectParentTemplates': ['host'],
+                    'selectMacros': ['macro', 'value'],
+                    'selectItems': 'count',
+                    'selectTriggers': 'count',
+                    'selectGraphs': 'count',
+                    'selectDiscoveries': 'count',
+                    'selectHttpTests': 'count'
                 },
             },
             'user': {
@@ -973,6 +1179,8 @@ class ZabbixCloneParameter():
             # MediaTypeのAPI -> CONFIG_EXPORT移動
             methodParameters['mediatype']['name'] = 'name'
             methodParameters['mediatype']['options']['output'] = ['name']
+            # インベントリモードがホストのプロパティに移動
+            methodParameters['host']['options']['output'].append('inventory_mode')
             sections['PRE'].remove('mediatype')
             sections['CONFIG_EXPORT'].update({'mediatype': 'mediaTypes'})
             sections['CONFIG_IMPORT'][4.4] = {}
@@ -990,6 +1198,8 @@ class ZabbixCloneParameter():
         if version['major'] >= 5.0:
             # usermacroにtype追加、textにのみ対応、secretはzc.conf読み込みで対応
             methodParameters['usermacro']['options']['filter'] = {'type': 0}
+            # インターフェイスのbulkがdetailsの中に移動
+            methodParameters['host']['options']['selectInterfaces'] = ['type', 'main', 'useip', 'ip', 'dns', 'port', 'details']
             # 不要になったカラム
             dbConfigDropCols.update(
                 {
@@ -1111,6 +1321,8 @@ class ZabbixCloneParameter():
                     }
                 }
             )
+            # テンプレートのUUID追加、中身を変えずに作り直したものも区別できる
+            methodParameters['template']['options']['output'].append('uuid')
             # パラメータ名変更対応
             value = methodParameters['action']['options'].pop('selectAcknowledgeOperations', None)
             methodParameters['action']['options']['selectUpdateOperations'] = value
@@ -1148,6 +1360,11 @@ class ZabbixCloneParameter():
             # Maitenanceのホストグループ指定ワードの変更
             value = methodParameters['maintenance']['options'].pop('selectGroups', None)
             methodParameters['maintenance']['options']['selectHostGroups'] = value
+            # ホスト/テンプレートのグループ指定ワードの変更
+            value = methodParameters['host']['options'].pop('selectGroups', None)
+            methodParameters['host']['options']['selectHostGroups'] = value
+            value = methodParameters['template']['options'].pop('selectGroups', None)
+            methodParameters['template']['options']['selectTemplateGroups'] = value
             # Usergroupの権限指定ワードの変更
             value = methodParameters['usergroup']['options'].pop('selectRights', None)
             methodParameters['usergroup']['options'].update(
@@ -1266,6 +1483,9 @@ class ZabbixCloneParameter():
                     }
                 }
             )
+            # ホストのプロキシ指定がプロキシ/プロキシグループに変更
+            methodParameters['host']['options']['output'].remove('proxy_hostid')
+            methodParameters['host']['options']['output'].extend(['monitored_by', 'proxyid', 'proxy_groupid'])
             # connectorは他と連携がない
             sections['PRE'].append('connector')
             # proxyより先にproxygroupを処理する
@@ -1416,8 +1636,25 @@ class ZabbixCloneDatastore():
     # 追加ストア指定
     extendStore = None
     # DynamoDBの負荷調整パラメータ
-    dydbLimit = 10
-    dydbWait = 2
+    # dydbRetries: スロットリング/UnprocessedItemsの再試行回数、dydbBackoffMax: 再試行の最大待機秒数
+    dydbRetries = 10
+    dydbBackoffMax = 2
+    # 書き込みのWCUの予算（0はテーブルのプロビジョンドWCU、オンデマンドは上限なし）と並列数
+    dydbWcu = 0
+    dydbWriters = ZC_DYDB_WRITERS
+    # Scanの並列セグメント数、VERSIONの新しい順の取得に使うGSI名（VERSION_GROUP/UNIXTIME）
+    dydbSegments = ZC_DYDB_SEGMENTS
+    dydbVersionIndex = None
+    dydbResource = None
+    # Redisの書き込みパラメータ
+    redisChunk = 1000
+    redisAtomic = False
+    # Redisのデータを複数のキーに分散して配置する（Redis Clusterでは必須）
+    redisShard = False
+    redisBuckets = ZC_REDIS_SHARD_BUCKETS
+    # ファイルストアをメソッドごとのシャードとマニフェストに分けて配置する
+    fileShard = False
+    fileShardItems = ZC_FILE_SHARD_ITEMS
 
     # エラーメッセージ関連
     MSG_NON_SUPPORT      = '%s: Non Supprt Datastore, %s.'
@@ -1425,6 +1662,19 @@ class ZabbixCloneDatastore():
     MSG_NO_CONFIG        = '%s: No Exist Connection Config.'
     MSG_FAILED_CLEAR     = '%s: Failed Clear, table:%s.'
     MSG_NO_EXIST_VERSION_CLIENT = 'No Exist VERSION client'
+
+    # ストアごとの実ファンクションを持つ共通処理の名前
+    # 実ファンクションは 名前 + ストア種別（例: getDataFromStoreRedis）、エクステンドストアはモジュールの同名ファンクション
+    STORE_FUNCTIONS = [
+        'initStoreSetting',
+        'clearStore',
+        'deleteRecordInStore',
+        'deleteVersionInStore',
+        'getVersionFromStore',
+        'setVersionToStore',
+        'getDataFromStore',
+        'setDataToStore',
+    ]
     
     def __init__(self, CONFIG):
 
@@ -1438,11 +1688,15 @@ class ZabbixCloneDatastore():
         # データストアへの接続情報
         self.storeType = CONFIG.storeType
         self.storeConnect = CONFIG.storeConnect
-        result = self.initStoreSetting()
-        if not result[0]:
-            sys.exit(result[1])
+        # 圧縮形式
+        try:
+            self.CODEC = ZabbixCloneCodec(CONFIG.storeCodec, CONFIG.storeCodecLevel)
+        except Exception as e:
+            sys.exit(f'Non Support Codec, {CONFIG.storeCodec}: {e}')
+        self.storeCodecDict = CONFIG.storeCodecDict
 
         # デフォルト対応以外のデータストア
+        # 接続設定の初期化でも使うので先に読み込む
         if self.storeType not in ['redis', 'dydb', 'file']:
             try:
                 # インポートの試行
@@ -1452,38 +1706,58 @@ class ZabbixCloneDatastore():
             except:
                 sys.exit(f'Non Suppoer Datastore, {self.storeType}')
 
+        # ストアの実ファンクションの対応表、呼び出しのたびに探さないようにここで決める
+        self.storeFunctions = self.resolveStoreFunctions()
+
+        result = self.initStoreSetting()
+        if not result[0]:
+            sys.exit(result[1])
+
+    def resolveStoreFunctions(self):
+        '''
+        共通処理名 -> 指定されたストアの実ファンクションの対応表を作る
+        返値: {funcName: function}
+        '''
+        functions = {}
+        for funcName in self.STORE_FUNCTIONS:
+            function = getattr(self, funcName + self.storeType.capitalize(), None)
+            if not function and self.extendStore:
+                # デフォルトになければエクステンドストアから指定、接続情報を渡す
+                extend = getattr(self.extendStore, funcName, None)
+                if extend:
+                    function = self.extendStoreFunction(extend)
+            if function:
+                functions[funcName] = function
+        return functions
+
+    def extendStoreFunction(self, extend):
+        '''
+        エクステンドストアのファンクションに接続情報を渡すラッパー
+        '''
+        def function(**params):
+            params['storeConnect'] = self.storeConnect
+            return extend(**params)
+        return function
+
     # ファンクション共通化
-    def functionWrapper(self, **params):
+    def functionWrapper(self, funcName, **params):
         '''
         各ファンクションの共通処理ラッパー
-        呼び出し名 + クラス初期化で設定されたストアのファンクションを実行
+        funcName: 呼び出し元の共通処理名、クラス初期化で設定されたストアのファンクションを実行
         '''
-        result = ZC_COMPLETE
-        try:
-            # このラッパーを呼び出したファンクションの名前
-            funcName = inspect.stack()[1].function
-        except:
-            return (False, 'functionWrapper() cannot be executed directly.')
-        # 実ファンクションの指定
-        function = getattr(self, funcName + self.storeType.capitalize(), None)
+        function = self.storeFunctions.get(funcName)
         if not function:
-            # デフォルトになければエクステンドストアから指定
-            function = getattr(self.extendStore, funcName, None)
-            params['storeConnect'] = self.storeConnect
-        if function:
-            # ファンクションの実行
-            result = function(**params) if params else function()
-        else:
             # ファンクションがない＝指定のストアに対応していない
-            result = (False, self.MSG_NON_SUPPORT % (funcName, self.storeType))
-        return result
+            return (False, self.MSG_NON_SUPPORT % (funcName, self.storeType))
+        # ファンクションの実行
+        return function(**params) if params else function()
 
     # ストア初期化関連
     def initStoreSetting(self):
         '''
         ストアの接続設定初期化
         '''
-        result = self.functionWrapper(storeConnect=self.storeConnect)
+        result = self.functionWrapper('initStoreSetting', storeConnect=self.storeConnect)
         if result[0]:
             self.storeTables = result[1]
             result = ZC_COMPLETE
@@ -1498,8 +1772,16 @@ class ZabbixCloneDatastore():
         import boto3
 
         # 負荷調整パラメーター
-        self.dydbLimit = storeConnect.get('dydbLimit', self.dydbLimit)
-        self.dydbWait = storeConnect.get('dydbWait', self.dydbWait)
+        self.dydbRetries = max(0, int(storeConnect.get('dydbRetries', self.dydbRetries)))
+        self.dydbBackoffMax = max(0, float(storeConnect.get('dydbBackoffMax', self.dydbBackoffMax)))
+        # 以前の制限数ごとの待機は書き込み容量（dydb_wcu）の調整に置き換えたので使わない
+        for key, name in [('dydbLimit', 'dydb_limit(--store-limit)'), ('dydbWait', 'dydb_wait(--store-interval)')]:
+            if storeConnect.get(key) is not None:
+                self.LOGGER.warning(f'{name} is Deprecated and Ignored, Use dydb_wcu/dydb_retries/dydb_backoff_max.')
+        self.dydbWcu = max(0, int(storeConnect.get('dydbWcu', self.dydbWcu)))
+        self.dydbWriters = max(1, int(storeConnect.get('dydbWriters', self.dydbWriters)))
+        self.dydbSegments = max(1, int(storeConnect.get('dydbSegments', self.dydbSegments)))
+        self.dydbVersionIndex = storeConnect.get('dydbVersionIndex', self.dydbVersionIndex)
 
         # 接続インスタンス生成
         if storeConnect.get('awsAccessId') and storeConnect.get('awsSecretKey'):
@@ -1519,6 +1801,7 @@ class ZabbixCloneDatastore():
 
         # テーブル操作初期化
         if result[0]:
+            self.dydbResource = dydb
             for table in self.storeTables.keys():
                 self.storeTables[table].update(
                     {
@@ -1529,6 +1812,9 @@ class ZabbixCloneDatastore():
                     # テーブルの有効確認
                     if self.storeTables[table]['client'].table_status != 'ACTIVE':
                         result = (False, f'{self.storeType}: No-Active Table, {table}')
+                    # 書き込みの予算、指定がなければテーブルのWCU（オンデマンドは0）
+                    wcu = self.dydbWcu or (self.storeTables[table]['client'].provisioned_throughput or {}).get('WriteCapacityUnits', 0)
+                    self.storeTables[table]['throttle'] = ZabbixCloneThrottle(wcu, self.dydbBackoffMax)
                 except:
                     # 実行失敗
                     result = (False, self.MSG_CONNECTION_ERROR % (self.storeType, table))
@@ -1543,8 +1829,34 @@ class ZabbixCloneDatastore():
 
         import redis
 
+        # 書き込みパラメーター
+        self.redisChunk = max(1, int(storeConnect.get('redisChunk', self.redisChunk)))
+        self.redisAtomic = storeConnect.get('redisAtomic', self.redisAtomic)
+        # キーの配置
+        self.redisShard = storeConnect.get('redisShard', self.redisShard)
+        self.redisBuckets = max(1, int(storeConnect.get('redisBuckets', self.redisBuckets)))
+        # 配置を変える前に書き込まれた（今と違う配置の）バージョン、読み込みと削除だけできる
+        self.redisOther = set()
+
         # 接続情報の確認
-        if storeConnect.get('redisHost') and storeConnect.get('redisPort'):
+        if storeConnect.get('redisCluster') and storeConnect.get('redisHost') and storeConnect.get('redisPort'):
+            # Redis ClusterはDBが0しかないのでVERSION/DATAで同じクライアントを使い、キーを分散配置にする
+            from redis.cluster import RedisCluster
+            self.redisShard = True
+            connectInfo = {
+                'host': storeConnect['redisHost'],
+                'port': storeConnect['redisPort'],
+            }
+            if storeConnect.get('redisPassword'):
+                connectInfo['password'] = storeConnect['redisPassword']
+            try:
+                client = RedisCluster(**connectInfo)
+                client.ping()
+                for table in self.storeTables.keys():
+                    self.storeTables[table]['client'] = client
+            except:
+                result = (False, self.MSG_CONNECTION_ERROR % (self.storeType, 'CLUSTER'))
+        elif storeConnect.get('redisHost') and storeConnect.get('redisPort'):
             # 接続設定の初期化
             idx = 0 # redisのDB番号
             for table in self.storeTables.keys():
@@ -1572,10 +1884,91 @@ class ZabbixCloneDatastore():
 
     def initStoreSettingFile(self, storeConnect):
         '''
-        ダミー
+        ファイルストア設定初期化
         '''
+        self.fileShard = storeConnect.get('fileShard', self.fileShard)
+        self.fileShardItems = max(1, int(storeConnect.get('fileShardItems', self.fileShardItems)))
         return (True, self.storeTables)
 
+    def fileStorePath(self):
+        '''
+        ファイルストアのディレクトリ
+        Windowsとその他でディレクトリを変える
+        '''
+        if os.name == 'nt':
+            # c:\user\アカウント\マイドキュメント\zc\
+            return os.path.join(
+                os.environ.get('userprofile'),
+                ZC_FILE_STORE[1],
+                'zc'
+            )
+        # /var/lib/zabbix/zc/
+        return os.path.join(
+            ZC_FILE_STORE[0],
+            'zc'
+        )
+
+    def fileStoreName(self, version, extension=True):
+        '''
+        ファイルストアのバージョンのファイル名（分割配置はディレクトリ名、拡張子なし）
+        {uuid}_{timestamp}_{ZabbixVer}.bz2
+        '''
+        name = '%s_%s_%s' % (
+            version['VERSION_ID'],
+            version['UNIXTIME'],
+            version['MASTER_VERSION']
+        )
+        return name + '.bz2' if extension else name
+
+    def readShardFile(self, directory, shard):
+        '''
+        シャードを読み込んで、ダイジェストを確認して解凍する
+        返値: [{item},...]
+        '''
+        with open(os.path.join(directory, shard['FILE']), 'rb') as f:
+            blob = f.read()
+        if hashlib.sha256(blob).hexdigest() != shard['DIGEST']:
+            raise ValueError(f'Broken Shard {shard["FILE"]}.')
+        return self.CODEC.decode(blob)
+
+    def writeShardFile(self, directory, version):
+        '''
+        self.STOREをメソッドごと、fileShardItems件ごとのシャードとマニフェストに分けて書き込む
+        書き込み途中のディレクトリに全部書いてからリネームする
+        '''
+        writing = directory + ZC_FILE_WRITING
+        if os.path.exists(writing):
+            shutil.rmtree(writing)
+        os.mkdir(writing)
+        shards = []
+        for method, items in self.STORE.items():
+            for seq, start in enumerate(range(0, len(items), self.fileShardItems)):
+                blob = self.CODEC.encode(items[start:start + self.fileShardItems])
+                file = f'{method}.{seq:04d}'
+                with open(os.path.join(writing, file), 'wb') as f:
+                    f.write(blob)
+                shards.append(
+                    {
+                        'METHOD': method,
+                        'FILE': file,
+                        'COUNT': len(items[start:start + self.fileShardItems]),
+                        'SIZE': len(blob),
+                        'DIGEST': hashlib.sha256(blob).hexdigest()
+                    }
+                )
+        manifest = {
+            'VERSION_ID': version['VERSION_ID'],
+            'UNIXTIME': version['UNIXTIME'],
+            'MASTER_VERSION': version['MASTER_VERSION'],
+            'CODEC': self.CODEC.name,
+            'SHARDS': shards
+        }
+        with open(os.path.join(writing, ZC_FILE_MANIFEST), 'w') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.rename(writing, directory)
+
     # 各ストア独自のファンクション
     def dydbNum(self, d=None):
         '''
@@ -1593,50 +1986,196 @@ class ZabbixCloneDatastore():
                 d = None
         return d
 
-    def dydbScan(self, table=None, projection=[]):
+    def dydbPages(self, table=None, projection=[], segments=1, **params):
+        '''
+        DynamoDB Scan/Queryのページごとのジェネレーター
+        1回1MBを超えた場合は継続キーで続きを取得して、ページごとに返す
+        table: 対象のDynamoDBテーブル
+        projection: 取得するAttribute（予約語があるのでプレースホルダーにする）
+        segments: Scanの並列セグメント数、2以上ならセグメントごとに並列で読んで読めたページから返す
+        params: scan/queryのパラメーター、KeyConditionExpressionがあればquery
+        '''
+        client = self.storeTables[table]['client']
+        if projection:
+            names = {f'#p{idx}': name for idx, name in enumerate(projection)}
+            params.update(
+                {
+                    'ProjectionExpression': ','.join(names.keys()),
+                    'ExpressionAttributeNames': {**params.get('ExpressionAttributeNames', {}), **names}
+                }
+            )
+        isQuery = 'KeyConditionExpression' in params
+        operation = client.query if isQuery else client.scan
+
+        def pages(params):
+            while True:
+                res = operation(**params)
+                yield res['Items']
+                # 継続キーが入ってたらなくなるまで繰り返し
+                if 'LastEvaluatedKey' not in res:
+                    break
+                params = {**params, 'ExclusiveStartKey': res['LastEvaluatedKey']}
+
+        if segments < 2 or isQuery:
+            yield from pages(params)
+            return
+        # 並列スキャン、セグメントごとに読んだページをキューに入れる（終わったらNone）
+        output = queue.Queue()
+
+        def segment(idx):
+            try:
+                for items in pages({**params, 'Segment': idx, 'TotalSegments': segments}):
+                    output.put(items)
+            except Exception as e:
+                output.put(e)
+            output.put(None)
+
+        with futures.ThreadPoolExecutor(max_workers=segments) as executor:
+            for idx in range(segments):
+                executor.submit(segment, idx)
+            done = 0
+            while done < segments:
+                items = output.get()
+                if items is None:
+                    done += 1
+                elif isinstance(items, Exception):
+                    raise items
+                else:
+                    yield items
+
+    def dydbScan(self, table=None, projection=[], segments=None):
         '''
         1回1MBを超えた場合の対策Scan
         taeble: 対象のDynamoDBテーブル
         projection: 取得するAttribute
+        segments: 並列セグメント数、Noneならdydb_segments
         '''
         if not table:
             return {'Items':[], 'Count': 0}
-        # 取得対象指定
-        client = self.storeTables[table]['client']
-        params = {'ProjectionExpression': ','.join(projection)} if projection else {}
+        Items = []
         try:
-            res = client.scan(**params)
+            for items in self.dydbPages(table, projection, segments or self.dydbSegments):
+                Items.extend(items)
         except:
             return {'Items':[], 'Count': 0}
-        Items = res['Items']
-        # 継続キーが入ってたらなくなるまで繰り返し
-        while 'LastEvaluatedKey' in res:
-            params.update({'ExclusiveStartKey': res['LastEvaluatedKey']})
-            res = client.scan(**params)
-            Items.extend(res['Items'])
         return {'Items': Items, 'Count': len(Items)}
 
-    def dydbQuery(self, table=None, version=''):
+    def dydbQuery(self, table=None, version='', projection=[], **params):
         '''
         DynamoDB Queryラッパー
-        フィルターは１つだけ
+        キーの条件はパーティションキー１つだけ
+        projection: 取得するAttribute
+        params: FilterExpressionなど追加のqueryパラメーター
         '''
         from boto3.dynamodb.conditions import Key
 
         if table not in self.storeTables.keys() or not version:
             return {'Items':[], 'Count': 0}
-        client = self.storeTables[table]['client']
         # キー指定
-        params = {'KeyConditionExpression': Key(self.storeTables[table]['primary']).eq(version)}
-        res = client.query(**params)
-        Items = res['Items']
-        # 継続キーが入ってたらなくなるまで繰り返し
-        while 'LastEvaluatedKey' in res:
-            params.update({'ExclusiveStartKey': res['LastEvaluatedKey']})
-            res = client.query(**params)
-            Items.extend(res['Items'])
+        params['KeyConditionExpression'] = Key(self.storeTables[table]['primary']).eq(version)
+        Items = []
+        for items in self.dydbPages(table, projection, **params):
+            Items.extend(items)
         return {'Items': Items, 'Count': len(Items)}
 
+    def dydbBatchWrite(self, table=None, requests=[]):
+        '''
+        DynamoDBのBatchWriteItemラッパー
+        ・ZC_DYDB_BATCH_SIZE件ごとに分けてdydbWriters並列で書き込む
+        ・テーブルのスロットル（トークンバケット）でWCUの予算に収める
+        ・スロットリングとUnprocessedItemsはジッター付きで待機してdydbRetries回まで再実行
+        requests: [{'PutRequest': {'Item': {}}}|{'DeleteRequest': {'Key': {}}},...]
+        返値: (boolean, message)
+        '''
+        from botocore.exceptions import ClientError
+
+        if table not in self.storeTables.keys():
+            return (False, f'No Exist Table {table}.')
+        tableName = self.storeTables[table]['client'].name
+        throttle = self.storeTables[table]['throttle']
+        # どこかが失敗したら他の書き込みも止める
+        stop = threading.Event()
+
+        def write(batch):
+            attempt = 0
+            while batch and not stop.is_set():
+                throttle.acquire(len(batch))
+                try:
+                    res = self.dydbResource.batch_write_item(
+                        RequestItems={tableName: batch},
+                        ReturnConsumedCapacity='TOTAL'
+                    )
+                except ClientError as e:
+                    if e.response.get('Error', {}).get('Code') not in ZC_DYDB_THROTTLE_ERRORS:
+                        raise
+                    # 全部スロットリングされた
+                    res = {'UnprocessedItems': {tableName: batch}}
+                capacity = sum([c.get('CapacityUnits', 0) for c in res.get('ConsumedCapacity', [])])
+                unprocessed = res.get('UnprocessedItems', {}).get(tableName, [])
+                throttle.consumed(len(batch), len(batch) - len(unprocessed), capacity)
+                if unprocessed:
+                    attempt += 1
+                    if attempt > self.dydbRetries:
+                        return False
+                    sleep(throttle.throttled(attempt))
+                else:
+                    throttle.succeeded()
+                batch = unprocessed
+            return not batch
+
+        result = ZC_COMPLETE
+        batches = [requests[idx:idx + ZC_DYDB_BATCH_SIZE] for idx in range(0, len(requests), ZC_DYDB_BATCH_SIZE)]
+        with futures.ThreadPoolExecutor(max_workers=self.dydbWriters) as executor:
+            tasks = [executor.submit(write, batch) for batch in batches]
+            for task in futures.as_completed(tasks):
+                if task.cancelled():
+                    continue
+                try:
+                    done = task.result()
+                except Exception as e:
+                    self.LOGGER.debug(e)
+                    done = False
+                if not done and not stop.is_set():
+                    stop.set()
+                    for other in tasks:
+                        other.cancel()
+                    result = (False, f'Failed batch_write_item {tableName}.')
+        return result
+
+    def dydbBatchGet(self, table=None, keys=[]):
+        '''
+        DynamoDBのBatchGetItemラッパー
+        ・ZC_DYDB_GET_SIZE件ごとに分けてdydbSegments並列で取得する
+        ・UnprocessedKeysはジッター付きで待機してdydbRetries回まで再実行
+        keys: [{primary: '', sort: ''},...]
+        返値: [item,...]（順不同）、取得できなければ例外
+        '''
+        tableName = self.storeTables[table]['client'].name
+
+        def get(keys):
+            items = []
+            attempt = 0
+            while keys:
+                res = self.dydbResource.batch_get_item(RequestItems={tableName: {'Keys': keys}})
+                items.extend(res.get('Responses', {}).get(tableName, []))
+                keys = res.get('UnprocessedKeys', {}).get(tableName, {}).get('Keys', [])
+                if keys:
+                    attempt += 1
+                    if attempt > self.dydbRetries:
+                        raise Exception(f'Unprocessed Keys {tableName}.')
+                    sleep(random.uniform(0, min(self.dydbBackoffMax, ZC_DYDB_BACKOFF * 2 ** attempt)))
+            return items
+
+        batches = [keys[idx:idx + ZC_DYDB_GET_SIZE] for idx in range(0, len(keys), ZC_DYDB_GET_SIZE)]
+        with futures.ThreadPoolExecutor(max_workers=self.dydbSegments) as executor:
+            return [item for items in executor.map(get, batches) for item in items]
+
+    def dydbChunkKey(self, dataId, seq):
+        '''
+        分割したDATAのソートキー
+        '''
+        return f'{ZC_DYDB_CHUNK_PREFIX}{dataId}#{seq:04d}'
+
     # ストア全消去
     def clearStore(self, table='ALL'):
         '''
@@ -1648,7 +2187,7 @@ class ZabbixCloneDatastore():
             tables = [table]
         else:
             return (False, f'required ALL / VERSION / DATA, tables:{table}.')
-        return self.functionWrapper(tables=tables)
+        return self.functionWrapper('clearStore', tables=tables)
 
     def clearStoreDydb(self, tables):
         '''
@@ -1657,39 +2196,72 @@ class ZabbixCloneDatastore():
         result = ZC_COMPLETE
 
         for table in tables:
-            client = self.storeTables[table]['client']
             primary_key = self.storeTables[table]['primary']
             sort_key = self.storeTables[table]['sort']
+            # キーだけを並列スキャン
             data = self.dydbScan(table, [primary_key, sort_key])
             if not data['Count']:
                 # データがなかったら飛ばす
                 continue
             # バッチ処理
-            count = 0
-            try:
-                with client.batch_writer() as batch:
-                    for row in data['Items']:
-                        item = {
-                            'Key': {
-                                primary_key: row[primary_key],
-                                sort_key: row[sort_key]
-                            }
+            requests = [
+                {
+                    'DeleteRequest': {
+                        'Key': {
+                            primary_key: row[primary_key],
+                            sort_key: row[sort_key]
                         }
-                        try:
-                            batch.delete_item(**item)
-                        except:
-                            break
-                        # 負荷調整、dydbLimit*10件ごとに1秒の待機
-                        count += 1
-                        if count > self.dydbLimit*10:
-                            sleep(self.dydbWait)
-                            count = 0
+                    }
+                } for row in data['Items']
+            ]
+            try:
+                if not self.dydbBatchWrite(table, requests)[0]:
+                    result = (False, self.MSG_FAILED_CLEAR % (self.storeType, tables))
             except Exception as e:
                 self.LOGGER.debug(e)
                 result = (False, self.MSG_FAILED_CLEAR % (self.storeType, tables))
 
         return result
 
+    def redisSharded(self, versionId):
+        '''
+        バージョンが分散配置で書き込まれているか
+        配置を変える前のバージョンはgetVersionFromStoreRedis()でredisOtherに入れて元の配置で読む
+        '''
+        return self.redisShard != (versionId in self.redisOther)
+
+    def redisVersionKey(self, versionId):
+        '''
+        RedisのVERSIONのキー
+        '''
+        return ZC_REDIS_SHARD_VERSION + versionId if self.redisSharded(versionId) else versionId
+
+    def redisDataKey(self, versionId, method=None, dataId=None):
+        '''
+        RedisのDATAのキー
+        分散配置の場合はバージョン、メソッド、DATA_IDのハッシュ値で分ける
+        '''
+        if not self.redisSharded(versionId):
+            return versionId
+        bucket = zlib.crc32(dataId.encode()) % self.redisBuckets
+        return f'{ZC_REDIS_SHARD_DATA}{versionId}:{method}:{bucket}'
+
+    def redisIndexKey(self, versionId):
+        '''
+        RedisのDATAの索引のキー
+        '''
+        if self.redisSharded(versionId):
+            return ZC_REDIS_SHARD_DATA + versionId + ZC_REDIS_DATA_INDEX
+        return versionId + ZC_REDIS_DATA_INDEX
+
+    def redisDictKey(self, versionId):
+        '''
+        Redisのバージョンの圧縮辞書のキー
+        '''
+        if self.redisSharded(versionId):
+            return ZC_REDIS_SHARD_DATA + versionId + ZC_REDIS_DATA_DICT
+        return versionId + ZC_REDIS_DATA_DICT
+
     def clearStoreRedis(self, tables):
         '''
         Redisストアリセット
@@ -1719,7 +2291,7 @@ class ZabbixCloneDatastore():
             uuid.UUID(dataId)
         except:
             return (False, 'versionId/dataId Must be UUID.')
-        return self.functionWrapper(version=versionId, data=dataId)
+        return self.functionWrapper('deleteRecordInStore', version=versionId, data=dataId)
 
     def deleteRecordInStoreDydb(self, version, data):
         return (False, f'{version}/{data}')
@@ -1740,13 +2312,38 @@ class ZabbixCloneDatastore():
             uuid.UUID(versionId)
         except:
             return (False, 'versionId Must be UUID.')
-        return self.functionWrapper(version=versionId)
+        return self.functionWrapper('deleteVersionInStore', version=versionId)
 
     def deleteVersionInStoreDydb(self, version):
         return (False, f'{version}')
 
     def deleteVersionInStoreRedis(self, version):
-        return (False, f'{version}')
+        '''
+        RedisからVERSION/DATAと索引のバージョンを削除する
+        '''
+        try:
+            pipe = self.storeTables['VERSION']['client'].pipeline(transaction=False)
+            pipe.delete(self.redisVersionKey(version))
+            pipe.zrem(ZC_REDIS_VERSION_INDEX, version)
+            pipe.execute()
+            client = self.storeTables['DATA']['client']
+            indexKey = self.redisIndexKey(version)
+            keys = [indexKey, self.redisDictKey(version)]
+            if self.redisSharded(version):
+                # 索引から分散したキーを集める
+                for method, value in client.hgetall(indexKey).items():
+                    for ids in json.loads(value).values():
+                        keys.extend([self.redisDataKey(version, method.decode(), dataId) for dataId in ids])
+            else:
+                keys.append(version)
+            pipe = client.pipeline(transaction=False)
+            for key in set(keys):
+                pipe.delete(key)
+            pipe.execute()
+        except Exception as e:
+            self.LOGGER.debug(e)
+            return (False, f'Except Delete {version}.')
+        return ZC_COMPLETE
 
     def getDatasetFromFile(self, versionId):
         '''
@@ -1765,12 +2362,15 @@ class ZabbixCloneDatastore():
             return (False, 'versionId Must be UUID.')
         return result
     
-    def getVersionFromStore(self, version=''):
+    def getVersionFromStore(self, version='', limit=0):
         '''
         version: ターゲットバージョン、Noneならすべて
+        limit: ターゲットバージョンがない場合に新しい方から取得する数、0ならすべて（索引のあるストアのみ）
         '''
         result = self.functionWrapper(
+            'getVersionFromStore',
             version=version,
+            limit=limit,
             client=self.storeTables['VERSION']['client']
         )
         if result[0]:
@@ -1786,12 +2386,34 @@ class ZabbixCloneDatastore():
         DynamoDBからVERSIONの全データを取得
         返値: (boolean, versions)
         '''
+        from boto3.dynamodb.conditions import Key
+
         version = params.get('version')
+        limit = params.get('limit', 0)
         versions = []
+        projection = ['VERSION_ID', 'UNIXTIME', 'MASTER_VERSION', 'DESCRIPTION', 'DIGEST']
         try:
-            # 1MB以上のダウンロードに対応したスキャンファンクションを使う
-            dls = self.dydbScan('VERSION')
-            dls = [dl for dl in dls['Items'] if dl['VERSION_ID'] == version] if version else dls['Items']
+            dls = []
+            if version:
+                # ターゲットバージョンはキー指定で取得
+                dls = self.dydbQuery('VERSION', version, projection)['Items']
+            elif limit > 0 and self.dydbVersionIndex:
+                # GSIから新しい順にlimit件だけ取得
+                for items in self.dydbPages(
+                    'VERSION',
+                    projection,
+                    IndexName=self.dydbVersionIndex,
+                    KeyConditionExpression=Key(ZC_DYDB_VERSION_GROUP).eq(ZC_HEAD),
+                    ScanIndexForward=False,
+                    Limit=limit
+                ):
+                    dls.extend(items)
+                    if len(dls) >= limit:
+                        break
+                dls = dls[:limit]
+            if not version and not dls:
+                # 1MB以上のダウンロードに対応したスキャンファンクションを使う
+                dls = self.dydbScan('VERSION', projection)['Items']
             for dl in dls:
                 # 成型して追加
                 versions.append(
@@ -1799,7 +2421,8 @@ class ZabbixCloneDatastore():
                         'VERSION_ID': dl['VERSION_ID'],
                         'UNIXTIME': self.dydbNum(dl['UNIXTIME']),
                         'MASTER_VERSION': self.dydbNum(dl['MASTER_VERSION']),
-                        'DESCRIPTION': dl['DESCRIPTION']
+                        'DESCRIPTION': dl['DESCRIPTION'],
+                        'DIGEST': dl.get('DIGEST', '')
                     }
                 )
             result = (True, versions)
@@ -1814,27 +2437,60 @@ class ZabbixCloneDatastore():
         返値: (boolean, versions)
         '''
         version = params.get('version')
+        limit = params.get('limit', 0)
         client = params.get('client')
         if not client:
             return (False, self.MSG_NO_EXIST_VERSION_CLIENT)
         versions = []
         try:
-            # Redisスキャン
-            dls = client.scan()
-            dls = [dl.decode() for dl in dls[1]]
-            if version in dls:
+            exists = False
+            if version:
+                exists = client.exists(self.redisVersionKey(version))
+                if not exists:
+                    # 配置を変える前のキーを確認する、なければ元に戻す
+                    self.redisOther ^= {version}
+                    exists = client.exists(self.redisVersionKey(version))
+                    if not exists:
+                        self.redisOther ^= {version}
+            if exists:
                 # ターゲットバージョンのみ取得
                 dls = [version]
+            else:
+                # 索引から新しい順に取得
+                dls = [dl.decode() for dl in client.zrevrange(ZC_REDIS_VERSION_INDEX, 0, limit - 1 if limit > 0 else -1)]
+                if not dls:
+                    # 索引のない古いデータはスキャン、カーソルが0に戻るまで全部取得
+                    dls = self.scanVersionRedis(client)
+            # バリューの取得、パイプラインで1回にまとめる
+            pipe = client.pipeline(transaction=False)
+            for id in dls:
+                pipe.hgetall(self.redisVersionKey(id))
+            dlData = dict(zip(dls, pipe.execute()))
+            # 見つからないものは配置を変える前のキーを確認する
+            missing = [id for id, dl in dlData.items() if not dl and id not in self.redisOther]
+            if missing:
+                self.redisOther.update(missing)
+                pipe = client.pipeline(transaction=False)
+                for id in missing:
+                    pipe.hgetall(self.redisVersionKey(id))
+                for id, dl in zip(missing, pipe.execute()):
+                    if dl:
+                        dlData[id] = dl
+                    else:
+                        self.redisOther.discard(id)
             for id in dls:
-                # バリューの取得
-                dl = client.hgetall(id)
+                dl = dlData[id]
+                if not dl:
+                    # 索引だけ残っているもの
+                    continue
                 # 成型して追加
                 versions.append(
                     {
                         'VERSION_ID': id,
                         'UNIXTIME': int(dl[b'UNIXTIME']),
                         'MASTER_VERSION': float(dl[b'MASTER_VERSION']),
-                        'DESCRIPTION': dl[b'DESCRIPTION'].decode()
+                        'DESCRIPTION': dl[b'DESCRIPTION'].decode(),
+                        'DIGEST': dl.get(b'DIGEST', b'').decode()
                     }
                 )
             result = (True, versions)
@@ -1843,28 +2499,42 @@ class ZabbixCloneDatastore():
             result = (False, [{}])
         return result
 
+    def scanVersionRedis(self, client):
+        '''
+        RedisのVERSIONのキーをスキャンで全部取得する（索引は除く）
+        配置を変える前のバージョンのキーも取得してredisOtherに入れる
+        返値: [VERSION_ID,...]
+        '''
+        if client is self.storeTables['DATA']['client']:
+            # Redis ClusterはDATAと同じDBなので分散配置のVERSIONのキーだけ
+            keys = client.scan_iter(match=ZC_REDIS_SHARD_VERSION + '*', count=ZC_REDIS_SCAN_COUNT)
+        else:
+            keys = client.scan_iter(count=ZC_REDIS_SCAN_COUNT)
+        versions = []
+        for dl in keys:
+            dl = dl.decode()
+            if dl == ZC_REDIS_VERSION_INDEX:
+                continue
+            shard = dl.startswith(ZC_REDIS_SHARD_VERSION)
+            versionId = dl[len(ZC_REDIS_SHARD_VERSION):] if shard else dl
+            if shard != self.redisShard:
+                self.redisOther.add(versionId)
+            versions.append(versionId)
+        return versions
+
     def getVersionFromStoreFile(self, **params):
         '''
         ディレクトリのファイルリストを取得
         '''
         version = params.get('version')
         versions = []
-        # Windowsとその他でディレクトリを変える
-        if os.name == 'nt':
-            # c:\user\アカウント\マイドキュメント\zc\{uuid}.json
-            path = os.path.join(
-                os.environ.get('userprofile'),
-                ZC_FILE_STORE[1],
-                'zc'
-            )
-        else:
-            # /var/lib/zabbix/zc/{uuid}.json
-            path = os.path.join(
-                ZC_FILE_STORE[0],
-                'zc'
-            )
-        # ファイル名の取得
-        files = [item for item in os.listdir(path) if os.path.isfile(os.path.join(path, item))]
+        path = self.fileStorePath()
+        # ファイル名の取得、分割配置はマニフェストのあるディレクトリ
+        files = [
+            item for item in os.listdir(path)
+                if os.path.isfile(os.path.join(path, item))
+                    or (os.path.isfile(os.path.join(path, item, ZC_FILE_MANIFEST)) and not item.endswith(ZC_FILE_WRITING))
+        ]
         # タイムスタンプの取得
         for file in files:
             desc = file
@@ -1887,10 +2557,12 @@ class ZabbixCloneDatastore():
             VERSION_ID='__NOT_YET_CLONE__',
             UNIXTIME=UNIXTIME(),
             MASTER_VERSION=str(ZC_DEFAULT_ZABBIX_VERSION),
-            DESCRIPTION=''
+            DESCRIPTION='',
+            DIGEST=''
         ):
         '''
         ストアにバージョンデータを追加する
+        DIGEST: メソッドごとのデータのハッシュ値（JSON）、ワーカーで変更のないセクションの判定に使う
         '''
         version = {
             'VERSION_ID':VERSION_ID,
@@ -1898,8 +2570,10 @@ class ZabbixCloneDatastore():
             'MASTER_VERSION': str(MASTER_VERSION),
             'DESCRIPTION': str(DESCRIPTION)
         }
+        if DIGEST:
+            version['DIGEST'] = str(DIGEST)
         client = self.storeTables['VERSION']['client']
-        result = self.functionWrapper(version=version, client=client)
+        result = self.functionWrapper('setVersionToStore', version=version, client=client)
         if not result[0]:
             result = (False, f'{self.storeType}: {result[1]}\n{json.dumps(version)}')
         return result
@@ -1917,8 +2591,8 @@ class ZabbixCloneDatastore():
         if not client:
             return (False, self.MSG_NO_EXIST_VERSION_CLIENT)
         try:
-            # 実行
-            res = client.put_item(**{'Item': version})
+            # 実行、GSIで新しい順に引けるように固定のパーティションキーを入れる
+            res = client.put_item(**{'Item': {**version, ZC_DYDB_VERSION_GROUP: ZC_HEAD}})
             resCode = res['ResponseMetadata'].get('HTTPStatusCode')
             if resCode != 200:
                 result = (False, f'Bad Response put_item, {resCode}.')
@@ -1942,9 +2616,21 @@ class ZabbixCloneDatastore():
         # キーは別パラメーターなので取り出す
         versionId = version.pop('VERSION_ID', None)
         try:
-            # 実行
-            res = client.hset(versionId, mapping=version)
-            if not res:
+            # 索引がなければ既存のバージョンを索引に追加する
+            if not client.exists(ZC_REDIS_VERSION_INDEX):
+                pipe = client.pipeline(transaction=False)
+                dls = self.scanVersionRedis(client)
+                for id in dls:
+                    pipe.hget(self.redisVersionKey(id), 'UNIXTIME')
+                index = {id: int(unixtime) for id, unixtime in zip(dls, pipe.execute()) if unixtime is not None}
+                if index:
+                    client.zadd(ZC_REDIS_VERSION_INDEX, index)
+            # 実行、バージョンと索引を同時に追加（分散配置ではキーのスロットが違うのでトランザクションにしない）
+            pipe = client.pipeline(transaction=not self.redisShard)
+            pipe.hset(self.redisVersionKey(versionId), mapping=version)
+            pipe.zadd(ZC_REDIS_VERSION_INDEX, {versionId: int(version['UNIXTIME'])})
+            res = pipe.execute()
+            if not res[0]:
                 result = (False, 'Bad Response VERSION hset.')
         except Exception as e:
             self.LOGGER.debug(e)
@@ -1957,9 +2643,12 @@ class ZabbixCloneDatastore():
         '''
         return ZC_COMPLETE
 
-    def getDataFromStore(self, version=None):
+    def getDataFromStore(self, version=None, methods=None, names=None, idOnly=False):
         '''
         ストアから対象のバージョンのDATAを取得する
+        methods: 取得するメソッドのリスト、Noneならすべて
+        names: 取得する名前のリスト、Noneならすべて
+        idOnly: DATA_ID/METHOD/NAMEだけでよい（DATAを取得しないストアがある）
         返値: [{method: [],...}]
         '''
         if not version:
@@ -1967,58 +2656,162 @@ class ZabbixCloneDatastore():
         client = self.storeTables['DATA']['client']
         if not client and not self.storeType == 'file':
             return (False, [])
-        result = self.functionWrapper(version=version, client=client)
+        result = self.functionWrapper(
+            'getDataFromStore',
+            version=version,
+            client=client,
+            methods=methods,
+            names=names,
+            idOnly=idOnly
+        )
         return result
 
+    def filterStoreItem(self, method, name, methods=None, names=None):
+        '''
+        getDataFromStore()のメソッド/名前指定に該当するか
+        '''
+        if methods and method not in methods:
+            return False
+        if names and name not in names:
+            return False
+        return True
+
     def getDataFromStoreDydb(self, **params):
         '''
         DynamoDBから対象バージョンのDATAを取得する
         返値: (boolean, [{item},...])
         '''
+        from boto3.dynamodb.conditions import Key, Attr
+
         data = []
         version = params['version']
-        # VERSION_IDでフィルタしてダウンロード
-        items = self.dydbQuery('DATA', version['VERSION_ID'])
-        if not items['Count']:
+        methods = params.get('methods')
+        names = params.get('names')
+        idOnly = params.get('idOnly')
+        primary = self.storeTables['DATA']['primary']
+        sort = self.storeTables['DATA']['sort']
+        # VERSION_IDのキー指定、分割したDATAのアイテムは後で読む、idOnlyならDATAを取得しない
+        query = {
+            'KeyConditionExpression': Key(primary).eq(version['VERSION_ID']) & Key(sort).lt(ZC_DYDB_CHUNK_PREFIX)
+        }
+        # メソッドの指定があれば転送量を減らすためにフィルタする
+        if methods:
+            query['FilterExpression'] = Attr('METHOD').is_in(list(methods))
+        count = 0
+        # 分割されたDATA {DATA_ID: (item, 分割数)}
+        chunked = {}
+        codec = self.CODEC
+        try:
+            if not idOnly:
+                # バージョンの辞書があれば辞書付きで解凍する
+                res = self.storeTables['DATA']['client'].get_item(
+                    Key={primary: version['VERSION_ID'], sort: ZC_DYDB_DICT_KEY}
+                )
+                if res.get('Item'):
+                    codec = ZabbixCloneCodec(self.CODEC.name, self.CODEC.level, res['Item']['DATA'].value)
+            # ページごとに解凍して、圧縮データを全部メモリに載せない
+            for items in self.dydbPages('DATA', ZC_DYDB_DATA_META if idOnly else [], **query):
+                for item in items:
+                    count += 1
+                    # 指定されたメソッド/名前以外は解凍しない
+                    if not self.filterStoreItem(item.get('METHOD'), item.get('NAME'), methods, names):
+                        continue
+                    # {METHOD:'', 'DATA_ID': '', 'NAME':'', 'DATA': b'encodedValue'})',...}
+                    # DATAのvalueを取り出してbz2でコード、json.loadsでdictに変換
+                    if 'DATA' in item:
+                        item['DATA'] = codec.decode(item['DATA'].value)
+                    chunks = int(item.pop('CHUNKS', 0))
+                    if chunks and not idOnly:
+                        # 分割されたDATA、後でまとめて取得
+                        chunked[item['DATA_ID']] = (item, chunks)
+                    data.append(item)
+            if chunked:
+                # 分割したアイテムを並列で取得して順番につなげる
+                keys = [
+                    {primary: version['VERSION_ID'], sort: self.dydbChunkKey(dataId, seq)}
+                        for dataId, (item, chunks) in chunked.items() for seq in range(chunks)
+                ]
+                pieces = {piece[sort]: piece['DATA'].value for piece in self.dydbBatchGet('DATA', keys)}
+                for dataId, (item, chunks) in chunked.items():
+                    blob = b''.join([pieces[self.dydbChunkKey(dataId, seq)] for seq in range(chunks)])
+                    item['DATA'] = codec.decode(blob)
+        except Exception as e:
+            self.LOGGER.debug(e)
+            return (False, data)
+        # バージョンのDATAが1件もない（メソッドでフィルタした場合は該当なしもありうる）
+        if not count and not methods:
             return (False, data)
-        for item in items['Items']:
-            try:
-                # {METHOD:'', 'DATA_ID': '', 'NAME':'', 'DATA': b'encodedValue'})',...}
-                # DATAのvalueを取り出してbz2でコード、json.loadsでdictに変換
-                item['DATA'] = json.loads(bz2.decompress(item['DATA'].value).decode())
-                data.append(item)
-            except Exception as e:
-                self.LOGGER.debug(e)
-                return (False, data)
         return (True, data)
 
     def getDataFromStoreRedis(self, **params):
         '''
         Redisから対象バージョンのDATAを取得する
+        メソッド/名前の指定があれば索引から対象のDATA_IDを引いてそれだけ取得する
         返値: (boolean, [{item},...])
         '''
         version = params['version']
         client = params['client']
+        methods = params.get('methods')
+        names = params.get('names')
         data=[]
+        codec = self.CODEC
+
+        def append(dataId, item):
+            # データの解凍
+            item = codec.decode(item)
+            if not self.filterStoreItem(item['METHOD'], item['NAME'], methods, names):
+                return
+            data.append(
+                {
+                    'DATA_ID': dataId.decode() if isinstance(dataId, bytes) else dataId,
+                    'METHOD': item['METHOD'],
+                    'NAME': item['NAME'],
+                    'DATA': item['DATA']
+                }
+            )
+
         try:
             version = version['VERSION_ID']
-            # Redisスキャン
-            scan = client.scan()
-            if version not in [item.decode() for item in scan[1]]:
+            indexKey = self.redisIndexKey(version)
+            # 分散配置は索引でバージョンの存在を確認する
+            if not client.exists(indexKey if self.redisSharded(version) else version):
                 return (False, f'No Exist {version}.')
-            items = client.hgetall(version)
-            # 成型して追加
-            for dataId, item in items.items():
-                # データのbz2解凍
-                item = json.loads(bz2.decompress(item).decode())
-                data.append(
-                    {
-                        'DATA_ID': dataId.decode(),
-                        'METHOD': item['METHOD'],
-                        'NAME': item['NAME'],
-                        'DATA': item['DATA']
-                    }
-                )
+            # バージョンの辞書があれば辞書付きで解凍する
+            dictionary = client.get(self.redisDictKey(version))
+            if dictionary:
+                codec = ZabbixCloneCodec(self.CODEC.name, self.CODEC.level, dictionary)
+            if (methods or names or self.redisSharded(version)) and client.exists(indexKey):
+                # 索引から対象のDATA_IDを引く {method: {name: [DATA_ID,...]}}
+                if methods:
+                    index = zip(methods, client.hmget(indexKey, methods))
+                else:
+                    index = client.hgetall(indexKey).items()
+                # キーごとのDATA_ID
+                keys = {}
+                for method, value in index:
+                    if not value:
+                        continue
+                    method = method.decode() if isinstance(method, bytes) else method
+                    for name, ids in json.loads(value).items():
+                        if not names or name in names:
+                            for dataId in ids:
+                                keys.setdefault(self.redisDataKey(version, method, dataId), []).append(dataId)
+                for key, dataIds in keys.items():
+                    if methods or names:
+                        # 対象のDATA_IDだけ取得
+                        for start in range(0, len(dataIds), ZC_REDIS_SCAN_COUNT):
+                            ids = dataIds[start:start + ZC_REDIS_SCAN_COUNT]
+                            for dataId, item in zip(ids, client.hmget(key, ids)):
+                                if item is not None:
+                                    append(dataId, item)
+                    else:
+                        # 分散したキーを順にhscanで取得
+                        for dataId, item in client.hscan_iter(key, count=ZC_REDIS_SCAN_COUNT):
+                            append(dataId, item)
+            else:
+                # 大きいハッシュを一度に取得しないようにhscanで順に取得して成型して追加
+                for dataId, item in client.hscan_iter(version, count=ZC_REDIS_SCAN_COUNT):
+                    append(dataId, item)
         except Exception as e:
             self.LOGGER.debug(e)
             return (False, f'{e}')
@@ -2030,42 +2823,74 @@ class ZabbixCloneDatastore():
         ストアデータをファイルから読み込む
         '''
         version = params['version']
+        methods = params.get('methods')
+        names = params.get('names')
+        path = self.fileStorePath()
 
-        file = '%s_%s_%s.%s' % (
-            version['VERSION_ID'],
-            version['UNIXTIME'],
-            version['MASTER_VERSION'],
-            'bz2'
-        )
+        # 分割配置、マニフェストだけ読んでメソッドのデータは使うときに読み込む
+        directory = os.path.join(path, self.fileStoreName(version, False))
+        if os.path.isfile(os.path.join(directory, ZC_FILE_MANIFEST)):
+            try:
+                with open(os.path.join(directory, ZC_FILE_MANIFEST)) as f:
+                    manifest = json.load(f)
+                self.STORE = ZabbixCloneLazyStore(
+                    [shard for shard in manifest['SHARDS'] if self.filterStoreItem(shard['METHOD'], None, methods)],
+                    lambda shard: self.readShardFile(directory, shard)
+                )
+                if names:
+                    # 名前の指定は読み込んでから絞る
+                    self.STORE = {
+                        method: [item for item in items if self.filterStoreItem(method, item.get('NAME'), methods, names)]
+                            for method, items in self.STORE.items()
+                    }
+            except Exception as e:
+                self.LOGGER.debug(e)
+                return (False, f'Cannot Read {directory}.')
+            return ZC_COMPLETE
 
-        # Windowsとその他でディレクトリを変える
-        if os.environ.get('os') == 'Windows_NT':
-            # c:\user\アカウント\マイドキュメント\zc\{uuid}_{timestamp}_{ZabbixVer}.bz2
-            file = os.path.join(
-                os.environ.get('userprofile'),
-                ZC_FILE_STORE[1],
-                'zc',
-                file
-            )
-        else:
-            # /var/lib/zabbix/zc/{uuid}_{timestamp}_{ZabbixVer}.bz2
-            file = os.path.join(
-                ZC_FILE_STORE[0],
-                'zc',
-                file
-            )
+        # {uuid}_{timestamp}_{ZabbixVer}.bz2
+        file = os.path.join(path, self.fileStoreName(version))
 
         # ファイル読み込み
+        # 全体を読んでから解凍/JSON変換せずに、解凍しながらアイテムごとに読み込む
+        # メソッド/名前の指定に該当しないアイテムはその場で捨てる
         if os.path.exists(file) and os.access(file, os.R_OK):
             try:
+                store = {}
                 with open(file, 'rb') as f:
-                    self.STORE = json.loads(bz2.decompress(f.read()).decode())
+                    for method, item in ZabbixCloneStoreReader(self.CODEC.iterDecompress(f, ZC_FILE_READ_BYTES)):
+                        if not self.filterStoreItem(method, None, methods):
+                            continue
+                        items = store.setdefault(method, [])
+                        if item is not None and self.filterStoreItem(method, item.get('NAME'), methods, names):
+                            items.append(item)
+                self.STORE = store
             except Exception as e:
                 self.LOGGER.debug(e)
                 return (False, f'Cannot Read {file}.')
 
         return ZC_COMPLETE
 
+    def codecSamples(self, dataset, serialize):
+        '''
+        辞書の学習用にデータセットから均等にZC_CODEC_DICT_SAMPLES件を取り出す
+        serialize: (method, item) -> 圧縮するのと同じbytes
+        '''
+        items = [(method, item) for method, items in dataset.items() for item in items]
+        step = max(1, len(items) // ZC_CODEC_DICT_SAMPLES)
+        return [serialize(method, item) for method, item in items[::step]]
+
+    def trainCodec(self, samples):
+        '''
+        storeCodecDictの場合はサンプルから辞書を学習したコーデックを使う
+        返値: (codec, dictionary)、辞書を使わない場合は(self.CODEC, None)
+        '''
+        if self.storeCodecDict and samples:
+            codec = self.CODEC.train(samples)
+            if codec:
+                return (codec, codec.dictionary)
+        return (self.CODEC, None)
+
     def setDataToStore(self, version=None):
         '''
         ストアにデータを追加する
@@ -2081,7 +2906,7 @@ class ZabbixCloneDatastore():
             for item in items:
                 item.update({'DATA_ID': str(uuid.uuid4())})
         # 実行
-        result = self.functionWrapper(version=version, dataset=self.STORE, client=client)
+        result = self.functionWrapper('setDataToStore', version=version, dataset=self.STORE, client=client)
         if not result[0]:
             return (False, f'{self.storeType}: {result[1]}')
         return result
@@ -2094,42 +2919,63 @@ class ZabbixCloneDatastore():
         result = ZC_COMPLETE
         version = params['version']
         dataset = params['dataset']
-        client = params['client']
         # データをDynamoDBのテーブルに合わせて１レコード１アイテムに変換
         # 1レコード400KBの制限があるのでDATAはbz2圧縮、大きいのはテンプレートのデータ
+        # 圧縮してもZC_DYDB_ITEM_BYTESを超えるものは分割して、元のアイテムには分割数（CHUNKS）を入れる
         setItems = []
+        # 辞書を使う場合はバージョンに1つ入れる
+        codec, dictionary = self.trainCodec(
+            self.codecSamples(dataset, lambda method, item: json.dumps(item['DATA'], ensure_ascii=False).encode())
+                if self.storeCodecDict else []
+        )
+        if dictionary:
+            setItems.append(
+                {
+                    'VERSION_ID': version['VERSION_ID'],
+                    'DATA_ID': ZC_DYDB_DICT_KEY,
+                    'DATA': dictionary
+                }
+            )
         for method, items in dataset.items():
             for item in items:
-                setItems.append(
-                    {
-                        'VERSION_ID': version['VERSION_ID'],
-                        'DATA_ID': item['DATA_ID'],
-                        'METHOD': method,
-                        'NAME': item['NAME'],
-                        'DATA': bz2.compress(json.dumps(item['DATA'], ensure_ascii=False).encode())
-                    }
-                )
-        # DynamoDBバッチ処理
-        count = 0
-        with client.batch_writer() as batch:
-            for item in setItems:
-                try:
-                    batch.put_item(**{'Item': item})
-                except Exception as e:
-                    self.LOGGER.debug(e)
-                    result = (False, f'Faild batch execute put_item.')
-                    break
-                # 負荷調整処理、dydbLimit数ごとにdydbWait秒待機する
-                # DynamoDBのWrite側インスタンス数設定に注意すること、AutoScalingしてると負荷によってはめっちゃでかくなる
-                count += 1
-                if count > self.dydbLimit:
-                    sleep(self.dydbWait)
-                    count = 0
+                blob = codec.encode(item['DATA'])
+                setItem = {
+                    'VERSION_ID': version['VERSION_ID'],
+                    'DATA_ID': item['DATA_ID'],
+                    'METHOD': method,
+                    'NAME': item['NAME']
+                }
+                if len(blob) <= ZC_DYDB_ITEM_BYTES:
+                    setItem['DATA'] = blob
+                    setItems.append(setItem)
+                    continue
+                pieces = [blob[idx:idx + ZC_DYDB_ITEM_BYTES] for idx in range(0, len(blob), ZC_DYDB_ITEM_BYTES)]
+                setItem['CHUNKS'] = len(pieces)
+                setItems.append(setItem)
+                for seq, piece in enumerate(pieces):
+                    setItems.append(
+                        {
+                            'VERSION_ID': version['VERSION_ID'],
+                            'DATA_ID': self.dydbChunkKey(item['DATA_ID'], seq),
+                            'DATA': piece
+                        }
+                    )
+        # DynamoDBバッチ処理、負荷はWCUの予算とスロットリングで調整する
+        # DynamoDBのWrite側インスタンス数設定に注意すること、AutoScalingしてると負荷によってはめっちゃでかくなる
+        try:
+            res = self.dydbBatchWrite('DATA', [{'PutRequest': {'Item': item}} for item in setItems])
+            if not res[0]:
+                result = (False, f'Faild batch execute put_item, {res[1]}')
+        except Exception as e:
+            self.LOGGER.debug(e)
+            result = (False, f'Faild batch execute put_item.')
         return result
 
     def setDataToStoreRedis(self, **params):
         '''
         Redisにデータを追加する
+        全体を一度にメモリに載せないようにredisChunkごとに圧縮してパイプラインで書き込む
+        redisAtomic: 書き込み用のキーに全部書いてからRENAMEして、バージョンのデータが一度に見えるようにする
         返値: (boolean, message)
         '''
         result = ZC_COMPLETE
@@ -2137,28 +2983,76 @@ class ZabbixCloneDatastore():
         version = params['version']
         dataset = params['dataset']
         client = params['client']
-        # データ変換、dict->JSON->bz2圧縮
-        data = {}
+        versionId = version['VERSION_ID']
+        indexKey = self.redisIndexKey(versionId)
+        # 分散配置はキーが複数あるのでRENAMEできない
+        # VERSIONはDATAの書き込み成功後に追加されるので、分散配置でもバージョンは一度に見える
+        atomic = self.redisAtomic and not self.redisShard
+        if atomic:
+            indexKey += ZC_REDIS_WRITING
+        # メソッド/名前 -> DATA_IDの索引 {method: {name: [DATA_ID,...]}}
+        index = {}
+
+        def dataKey(method, dataId):
+            if atomic:
+                return versionId + ZC_REDIS_WRITING
+            return self.redisDataKey(versionId, method, dataId)
+
+        # データ変換、dict->JSON->圧縮
+        def serialize(method, item):
+            return json.dumps(
+                {
+                    'METHOD': method,
+                    'NAME': item['NAME'],
+                    'DATA': item['DATA']
+                },
+                ensure_ascii=False
+            ).encode()
+
+        codec, dictionary = self.trainCodec(self.codecSamples(dataset, serialize) if self.storeCodecDict else [])
+
+        def encode(method, item):
+            return codec.compress(serialize(method, item))
+
         try:
+            if atomic:
+                client.delete(versionId + ZC_REDIS_WRITING)
+            # 辞書はデータより先に書く
+            if dictionary:
+                client.set(self.redisDictKey(versionId), dictionary)
+            else:
+                client.delete(self.redisDictKey(versionId))
+            pipe = client.pipeline(transaction=False)
+            # キーごとの書き込み待ちデータ
+            buffers = {}
+            count = 0
+            written = 0
             for method, items in dataset.items():
                 for item in items:
-                    data.update(
-                        {
-                            item['DATA_ID']: bz2.compress(
-                                json.dumps(
-                                    {
-                                        'METHOD': method,
-                                        'NAME': item['NAME'],
-                                        'DATA': item['DATA']
-                                    },
-                                    ensure_ascii=False
-                                ).encode()
-                            )
-                        }
-                    )
-            res = client.hset(version['VERSION_ID'], mapping=data)
-            if not res:
-                result = (False, 'Bad Response DATA hset')
+                    index.setdefault(method, {}).setdefault(item['NAME'], []).append(item['DATA_ID'])
+                    key = dataKey(method, item['DATA_ID'])
+                    data = buffers.setdefault(key, {})
+                    data[item['DATA_ID']] = encode(method, item)
+                    if len(data) >= ZC_REDIS_HSET_FIELDS:
+                        pipe.hset(key, mapping=buffers.pop(key))
+                        count += len(data)
+                    if count >= self.redisChunk:
+                        written += sum(pipe.execute())
+                        count = 0
+            for key, data in buffers.items():
+                pipe.hset(key, mapping=data)
+            written += sum(pipe.execute())
+            if not written:
+                return (False, 'Bad Response DATA hset')
+            # 索引はデータの後に書く（索引がなければ全体から取得する）
+            client.delete(indexKey)
+            client.hset(
+                indexKey,
+                mapping={method: json.dumps(names, ensure_ascii=False) for method, names in index.items()}
+            )
+            if atomic:
+                client.rename(versionId + ZC_REDIS_WRITING, versionId)
+                client.rename(indexKey, self.redisIndexKey(versionId))
         except Exception as e:
             self.LOGGER.debug(e)
             result = (False, f'Except DATA hset.')
@@ -2172,35 +3066,24 @@ class ZabbixCloneDatastore():
         result = ZC_COMPLETE
         if not version:
             return (False, 'version Empty.')
-        
-        file = '%s_%s_%s.%s' % (
-            version['VERSION_ID'],
-            version['UNIXTIME'],
-            version['MASTER_VERSION'],
-            'bz2'
-        )
+        path = self.fileStorePath()
 
-        # Windowsとその他でディレクトリを変える
-        if os.environ.get('os') == 'Windows_NT':
-            # c:\user\アカウント\マイドキュメント\zc\{uuid}_{X.Y}.json
-            path = os.path.join(
-                os.environ.get('userprofile'),
-                ZC_FILE_STORE[1],
-                'zc'
-            )
-        else:
-            # /var/lib/zabbix/zc/{uuid}.json
-            path = os.path.join(
-                ZC_FILE_STORE[0],
-                'zc'
-            )
-
-        # ファイル読み込み
+        # ファイル書き込み
         if os.path.exists(path) and os.access(path, os.W_OK):
-            file = os.path.join(path, file)
+            if self.fileShard:
+                # メソッドごとのシャードとマニフェスト
+                directory = os.path.join(path, self.fileStoreName(version, False))
+                try:
+                    self.writeShardFile(directory, version)
+                except Exception as e:
+                    self.LOGGER.debug(e)
+                    result = (False, f'Cannot Write {directory}.')
+                return result
+            file = os.path.join(path, self.fileStoreName(version))
             try:
                 with open(file, mode='wb') as f:
-                    f.write(bz2.compress(json.dumps(self.STORE, ensure_ascii=False).encode()))
+                    # ファイル名の拡張子は以前のまま（bz2以外でもヘッダーで判別する）
+                    f.write(self.CODEC.encode(self.STORE))
             except Exception as e:
                 self.LOGGER.debug(e)
                 result = (False, f'Cannot Write {file}.')
@@ -2208,6 +3091,595 @@ class ZabbixCloneDatastore():
             result = (False, f'No Such or Not Writable {path}')
         return result
 
+class ZabbixCloneLazyStore(dict):
+    '''
+    ファイルストア（分割配置）のSTORE、メソッドのデータは最初に使うときにシャードを読み込む
+    ・マニフェストのメソッドはキーとして見える（in/len/イテレート）
+    ・get/[]はそのメソッドのシャードだけ解凍する、items/valuesは全部読み込む
+    '''
+
+    def __init__(self, shards, loader):
+        super().__init__()
+        # 読み込み前のメソッドのシャード {method: [shard,...]}
+        self.pending = {}
+        for shard in shards:
+            self.pending.setdefault(shard['METHOD'], []).append(shard)
+        self.loader = loader
+
+    def load(self, method):
+        shards = self.pending.pop(method, None)
+        if shards is not None:
+            items = []
+            for shard in shards:
+                items.extend(self.loader(shard))
+            super().__setitem__(method, items)
+
+    def loadAll(self):
+        for method in list(self.pending.keys()):
+            self.load(method)
+
+    def __getitem__(self, method):
+        self.load(method)
+        return super().__getitem__(method)
+
+    def get(self, method, default=None):
+        self.load(method)
+        return super().get(method, default)
+
+    def setdefault(self, method, default=None):
+        self.load(method)
+        return super().setdefault(method, default)
+
+    def pop(self, method, *default):
+        self.load(method)
+        return super().pop(method, *default)
+
+    def __setitem__(self, method, items):
+        self.pending.pop(method, None)
+        super().__setitem__(method, items)
+
+    def __delitem__(self, method):
+        if self.pending.pop(method, None) is not None and not super().__contains__(method):
+            return
+        super().__delitem__(method)
+
+    def __contains__(self, method):
+        return method in self.pending or super().__contains__(method)
+
+    def __len__(self):
+        return len(self.pending) + super().__len__()
+
+    def __iter__(self):
+        return iter(list(super().keys()) + list(self.pending.keys()))
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        self.loadAll()
+        return super().items()
+
+    def values(self):
+        self.loadAll()
+        return super().values()
+
+    def copy(self):
+        self.loadAll()
+        return dict(super().items())
+
+    def __eq__(self, other):
+        self.loadAll()
+        return super().__eq__(other)
+
+    def __repr__(self):
+        self.loadAll()
+        return super().__repr__()
+
+class ZabbixCloneStoreReader():
+    '''
+    STOREのJSON {method: [item,...]} のストリーム読み込みクラス
+    ・解凍したbytesを少しずつテキストにして、アイテムごとにraw_decodeする
+    ・メモリにはJSONのテキストの読み込み途中の部分と、読み込んだアイテムしか載らない
+    ・イテレートすると (method, None)（メソッドの開始）、(method, item) の順に返す
+    '''
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.text = codecs.getincrementaldecoder('utf-8')()
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def more(self):
+        '''
+        次のチャンクを読み足す、読み込み済みの部分は捨てる
+        '''
+        if self.eof:
+            return False
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        try:
+            self.buffer += self.text.decode(next(self.chunks))
+        except StopIteration:
+            self.buffer += self.text.decode(b'', final=True)
+            self.eof = True
+        return True
+
+    def peek(self):
+        '''
+        空白を飛ばして次の文字、終わりなら空文字
+        '''
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.more():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f'Unexpected {char!r} in Store JSON.')
+        self.pos += 1
+        return char
+
+    def value(self):
+        '''
+        次のJSONの値（文字列/オブジェクト）
+        途中で切れていたら残りの倍の量まで読み足して再試行する（大きいアイテムでも読み直しが増えすぎない）
+        '''
+        self.peek()
+        while True:
+            try:
+                value, self.pos = self.decoder.raw_decode(self.buffer, self.pos)
+                return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                target = (len(self.buffer) - self.pos) * 2
+                while len(self.buffer) - self.pos < target and self.more():
+                    pass
+
+    def __iter__(self):
+        self.expect('{')
+        if self.peek() == '}':
+            return
+        while True:
+            method = self.value()
+            self.expect(':')
+            self.expect('[')
+            yield (method, None)
+            if self.peek() == ']':
+                self.pos += 1
+            else:
+                while True:
+                    yield (method, self.value())
+                    if self.expect(',]') == ']':
+                        break
+            if self.expect(',}') == '}':
+                return
+
+class ZabbixCloneCodec():
+    '''
+    ストアのデータの圧縮/解凍クラス
+    ・圧縮データの先頭にヘッダー（ZC_CODEC_MAGIC + コーデック番号）を付ける
+    ・ヘッダーのないデータは以前の形式（bz2）として解凍する
+    ・bz2はヘッダーを付けない（以前のバージョンでも読める）
+    ・zstd(zstandard)/lz4はモジュールがある場合のみ
+    ・辞書はzlib/zstdの圧縮と、辞書付きデータ（ヘッダーに辞書のCRC32）の解凍に使う
+    '''
+    # コーデック名: (番号, デフォルトレベル)
+    CODECS = {
+        'bz2': (1, 9),
+        'zlib': (2, 6),
+        'gzip': (3, 6),
+        'lzma': (4, 6),
+        'zstd': (5, 3),
+        'lz4': (6, 0),
+    }
+
+    # 辞書が使えるコーデック
+    DICT_CODECS = ['zlib', 'zstd']
+
+    def __init__(self, name=ZC_DEFAULT_CODEC, level=None, dictionary=None):
+        if name not in self.CODECS:
+            raise ValueError(f'choose from {", ".join(self.CODECS.keys())}')
+        self.name = name
+        self.level = self.CODECS[name][1] if level is None else int(level)
+        self.dictionary = dictionary
+        self.dictionaryId = zlib.crc32(dictionary) if dictionary else None
+        # モジュールがなければここでImportError
+        if dictionary and name in self.DICT_CODECS:
+            self.compressor = self.dictCodec(name, dictionary)[0]
+        else:
+            self.compressor = self.codec(name)[0]
+        # 解凍はデータのヘッダーのコーデックで行う {番号: decompress}
+        self.decompressors = {}
+
+    @staticmethod
+    def codec(name):
+        '''
+        コーデック名 -> (compress(data, level), decompress(data))
+        '''
+        if name == 'bz2':
+            return (lambda data, level: bz2.compress(data, level), bz2.decompress)
+        if name == 'zlib':
+            return (lambda data, level: zlib.compress(data, level), zlib.decompress)
+        if name == 'gzip':
+            import gzip
+            return (lambda data, level: gzip.compress(data, level, mtime=0), gzip.decompress)
+        if name == 'lzma':
+            import lzma
+            return (lambda data, level: lzma.compress(data, preset=level), lzma.decompress)
+        if name == 'zstd':
+            import zstandard
+            return (
+                lambda data, level: zstandard.ZstdCompressor(level=level).compress(data),
+                lambda data: zstandard.ZstdDecompressor().decompress(data)
+            )
+        if name == 'lz4':
+            import lz4.frame
+            return (lambda data, level: lz4.frame.compress(data, compression_level=level), lz4.frame.decompress)
+        raise ValueError(f'Non Support Codec, {name}.')
+
+    @staticmethod
+    def dictCodec(name, dictionary):
+        '''
+        辞書付きのコーデック名 -> (compress(data, level), decompress(data))
+        '''
+        if name == 'zlib':
+            def compress(data, level):
+                compressor = zlib.compressobj(level, zdict=dictionary)
+                return compressor.compress(data) + compressor.flush()
+
+            def decompress(data):
+                decompressor = zlib.decompressobj(zdict=dictionary)
+                return decompressor.decompress(data) + decompressor.flush()
+            return (compress, decompress)
+        if name == 'zstd':
+            import zstandard
+            zdict = zstandard.ZstdCompressionDict(dictionary)
+            return (
+                lambda data, level: zstandard.ZstdCompressor(level=level, dict_data=zdict).compress(data),
+                lambda data: zstandard.ZstdDecompressor(dict_data=zdict).decompress(data)
+            )
+        raise ValueError(f'Non Support Dictionary Codec, {name}.')
+
+    @classmethod
+    def codecName(cls, number):
+        name = [name for name, codec in cls.CODECS.items() if codec[0] == number]
+        if not name:
+            raise ValueError(f'Unknown Codec Number, {number}.')
+        return name[0]
+
+    @classmethod
+    def available(cls):
+        '''
+        使えるコーデック名のリスト
+        '''
+        names = []
+        for name in cls.CODECS.keys():
+            try:
+                cls.codec(name)
+                names.append(name)
+            except ImportError:
+                pass
+        return names
+
+    def compress(self, data):
+        body = self.compressor(data, self.level)
+        number = self.CODECS[self.name][0]
+        if self.dictionary and self.name in self.DICT_CODECS:
+            return ZC_CODEC_MAGIC + bytes([number | ZC_CODEC_DICT_FLAG]) + self.dictionaryId.to_bytes(4, 'big') + body
+        if self.name == 'bz2':
+            return body
+        return ZC_CODEC_MAGIC + bytes([number]) + body
+
+    def decompress(self, blob):
+        if not blob.startswith(ZC_CODEC_MAGIC):
+            # ヘッダーなしは以前のbz2
+            return bz2.decompress(blob)
+        number = blob[len(ZC_CODEC_MAGIC)]
+        offset = len(ZC_CODEC_MAGIC) + 1
+        if number & ZC_CODEC_DICT_FLAG:
+            # 辞書付き、辞書が違うと解凍できないのでIDを照合する
+            if int.from_bytes(blob[offset:offset + 4], 'big') != self.dictionaryId:
+                raise ValueError('Codec Dictionary Mismatch.')
+            offset += 4
+        if number not in self.decompressors:
+            name = self.codecName(number & ~ZC_CODEC_DICT_FLAG)
+            if number & ZC_CODEC_DICT_FLAG:
+                self.decompressors[number] = self.dictCodec(name, self.dictionary)[1]
+            else:
+                self.decompressors[number] = self.codec(name)[1]
+        return self.decompressors[number](blob[offset:])
+
+    @staticmethod
+    def streamCodec(name):
+        '''
+        コーデック名 -> 少しずつ解凍するオブジェクト（decompress(data)）
+        '''
+        if name == 'bz2':
+            return bz2.BZ2Decompressor()
+        if name == 'zlib':
+            return zlib.decompressobj()
+        if name == 'gzip':
+            return zlib.decompressobj(wbits=31)
+        if name == 'lzma':
+            import lzma
+            return lzma.LZMADecompressor()
+        if name == 'zstd':
+            import zstandard
+            return zstandard.ZstdDecompressor().decompressobj()
+        if name == 'lz4':
+            import lz4.frame
+            return lz4.frame.LZ4FrameDecompressor()
+        raise ValueError(f'Non Support Codec, {name}.')
+
+    def iterDecompress(self, f, size=ZC_FILE_READ_BYTES):
+        '''
+        ファイルからsizeずつ読んで解凍したbytesを返すジェネレーター
+        ヘッダーのないデータは以前のbz2、辞書付きのデータは不可
+        '''
+        head = f.read(len(ZC_CODEC_MAGIC) + 1)
+        if head.startswith(ZC_CODEC_MAGIC) and len(head) > len(ZC_CODEC_MAGIC):
+            if head[-1] & ZC_CODEC_DICT_FLAG:
+                raise ValueError('Dictionary Codec Cannot Stream.')
+            decompressor = self.streamCodec(self.codecName(head[-1]))
+            chunk = b''
+        else:
+            decompressor = self.streamCodec('bz2')
+            chunk = head
+        while True:
+            if chunk:
+                data = decompressor.decompress(chunk)
+                if data:
+                    yield data
+            chunk = f.read(size)
+            if not chunk:
+                break
+        if hasattr(decompressor, 'flush'):
+            data = decompressor.flush()
+            if data:
+                yield data
+
+    def train(self, samples):
+        '''
+        アイテムのサンプル（bytes）から辞書を学習して、辞書付きのコーデックを返す
+        zstdはzstandardの学習、それ以外はzlibのプリセット辞書（サンプルの断片を並べる）
+        学習できなければNone
+        '''
+        name = self.name if self.name in self.DICT_CODECS else 'zlib'
+        level = self.level if name == self.name else None
+        try:
+            if name == 'zstd':
+                import zstandard
+                dictionary = zstandard.train_dictionary(ZC_CODEC_DICT_BYTES, samples).as_bytes()
+            else:
+                dictionary = self.zlibDictionary(samples)
+        except Exception:
+            return None
+        if not dictionary:
+            return None
+        return ZabbixCloneCodec(name, level, dictionary)
+
+    @staticmethod
+    def zlibDictionary(samples):
+        '''
+        zlibのプリセット辞書、サンプルから均等に選んだアイテムの先頭を並べてウィンドウ（32KB）に収める
+        '''
+        if not samples:
+            return b''
+        count = min(len(samples), ZC_CODEC_DICT_BYTES // ZC_CODEC_DICT_PIECE)
+        step = len(samples) / count
+        return b''.join([samples[int(idx * step)][:ZC_CODEC_DICT_PIECE] for idx in range(count)])[-ZC_CODEC_DICT_BYTES:]
+
+    def encode(self, data):
+        '''
+        dict -> JSON -> 圧縮
+        '''
+        return self.compress(json.dumps(data, ensure_ascii=False).encode())
+
+    def decode(self, blob):
+        '''
+        解凍 -> JSON -> dict
+        '''
+        return json.loads(self.decompress(blob).decode())
+
+    @classmethod
+    def benchmark(cls, blobs, codecs=None, levels={}, dictionary=True):
+        '''
+        JSON（bytes）のリストの圧縮率と速度（MB/s）を計測する
+        blobsはストアの圧縮単位にする（Redis/DynamoDBはアイテムごと、ファイルはバージョン全体かシャードごと）
+        codecs: 計測するコーデック、Noneなら使えるものすべて
+        levels: コーデックごとのレベル指定 {name: level}、なければデフォルト
+        dictionary: 辞書が使えるコーデックは、blobsから学習した辞書付き（名前+dict）も計測する
+        返値: [{'CODEC', 'LEVEL', 'RATIO', 'COMPRESS', 'DECOMPRESS'},...]
+        '''
+        total = sum([len(blob) for blob in blobs])
+        megaBytes = total / 1024 / 1024
+        results = []
+        targets = []
+        for name in codecs or cls.available():
+            codec = cls(name, levels.get(name))
+            targets.append((name, codec))
+            if dictionary and name in cls.DICT_CODECS:
+                trained = codec.train(blobs)
+                if trained:
+                    targets.append((f'{name}+dict', trained))
+        for name, codec in targets:
+            start = monotonic()
+            compressed = [codec.compress(blob) for blob in blobs]
+            compressTime = monotonic() - start
+            start = monotonic()
+            for blob in compressed:
+                codec.decompress(blob)
+            decompressTime = monotonic() - start
+            size = sum([len(blob) for blob in compressed])
+            results.append(
+                {
+                    'CODEC': name,
+                    'LEVEL': codec.level,
+                    'RATIO': total / size if size else 0,
+                    'COMPRESS': megaBytes / compressTime if compressTime else 0,
+                    'DECOMPRESS': megaBytes / decompressTime if decompressTime else 0,
+                }
+            )
+        return results
+
+class ZabbixCloneChunker():
+    '''
+    configuration.export/importの区切り数の自動調整クラス
+    実行結果のデータ量と応答時間から次の区切り数を決める
+    ・1件あたりの平均データ量からtargetBytesに収まる数にする
+    ・応答時間がtargetSecを超えたらその比率で減らす
+    ・タイムアウトやサイズ超過（phpのmemory_limitなど）で失敗したら半分にする
+    ・minCount-maxCountの範囲に収める
+    '''
+
+    def __init__(self, count, minCount=ZC_SEPARATE_MIN, maxCount=ZC_SEPARATE_MAX, targetBytes=ZC_SEPARATE_BYTES, targetSec=ZC_SEPARATE_SEC):
+        self.minCount = max(1, minCount)
+        self.maxCount = max(self.minCount, maxCount)
+        self.targetBytes = targetBytes
+        self.targetSec = targetSec
+        self.count = self.clamp(count)
+
+    def clamp(self, count):
+        return int(min(self.maxCount, max(self.minCount, count)))
+
+    def nextCount(self, items, sizeOf=None):
+        '''
+        itemsの先頭から次に実行する数を返す
+        sizeOf: 実行前にデータ量が分かる場合（インポート）のデータ量取得ファンクション
+        '''
+        count = min(self.count, len(items))
+        if sizeOf:
+            # データ量が分かる場合はtargetBytesを超えない数にする（最低1件）
+            total = 0
+            for idx in range(count):
+                total += sizeOf(items[idx])
+                if total > self.targetBytes and idx > 0:
+                    return idx
+        return max(1, count)
+
+    def feedback(self, count, size, elapsed):
+        '''
+        実行結果（件数、データ量、応答時間）から区切り数を調整する
+        '''
+        if count < 1:
+            return
+        candidates = []
+        if size > 0:
+            candidates.append(self.targetBytes * count / size)
+        if elapsed > 0:
+            candidates.append(self.targetSec * count / elapsed)
+        if not candidates:
+            return
+        # 急に変わらないように今の値との間をとる
+        self.count = self.clamp((self.count + min(candidates)) / 2)
+
+    def shrink(self, count):
+        '''
+        失敗したので失敗した数の半分にする
+        '''
+        self.count = self.clamp(min(self.count, count) // 2)
+
+    @staticmethod
+    def overload(error):
+        '''
+        区切り数を減らすべき失敗（タイムアウト、サイズ超過、応答なし）か
+        データの不備による失敗は区切り数に関係ないのでFalse
+        '''
+        # 原因の例外もたどる（APIクライアントがHTTPの例外を包んで投げる）
+        errors = []
+        while isinstance(error, BaseException) and error not in errors:
+            errors.append(error)
+            error = error.__cause__ or error.__context__
+        if not errors:
+            errors = [error]
+        for item in errors:
+            if isinstance(item, (TimeoutError, ConnectionError)):
+                return True
+            status = getattr(item, 'code', None) or getattr(getattr(item, 'response', None), 'status_code', None)
+            if status in ZC_SEPARATE_OVERLOAD_STATUS:
+                return True
+            message = str(item).lower()
+            if any([re.search(pattern, message) for pattern in ZC_SEPARATE_OVERLOAD]):
+                return True
+        return False
+
+class ZabbixCloneThrottle():
+    '''
+    DynamoDBの書き込み容量の調整クラス（トークンバケット）
+    ・rate（WCU/秒）でトークンを補充し、書き込み前に見込みの消費量を取る
+    ・ConsumedCapacityの実績で1件あたりの消費量の見込みとトークンを補正する
+    ・スロットリングされたらrateを半分にして、ジッター付きで待機する
+    ・成功したらrateを予算まで少しずつ戻す
+    ・rate=0は上限なし（オンデマンド）、スロットリング時の待機だけ行う
+    '''
+
+    def __init__(self, rate=0, maxWait=2):
+        self.limit = max(0, rate)
+        self.rate = self.limit
+        self.maxWait = maxWait
+        # 1件あたりの消費WCUの見込み
+        self.unit = 1.0
+        self.tokens = self.rate
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, count):
+        '''
+        count件分のトークンが貯まるまで待つ
+        バケットより大きい場合は満杯になったら取る（マイナスの分は次が待つ）
+        '''
+        if not self.limit:
+            return
+        while True:
+            with self.lock:
+                self.refill()
+                cost = count * self.unit
+                if self.tokens >= min(cost, self.rate):
+                    self.tokens -= cost
+                    return
+                wait = (min(cost, self.rate) - self.tokens) / self.rate
+            sleep(wait)
+
+    def consumed(self, count, written, capacity):
+        '''
+        実行結果（件数、書き込めた件数、ConsumedCapacity）で見込みを補正する
+        '''
+        with self.lock:
+            self.tokens += count * self.unit - capacity
+            if written and capacity:
+                self.unit = (self.unit + capacity / written) / 2
+
+    def throttled(self, attempt):
+        '''
+        スロットリングされたのでrateを下げて、待機秒数を返す（Full Jitter）
+        '''
+        with self.lock:
+            if self.limit:
+                self.rate = max(1, self.rate / 2)
+                self.tokens = min(self.tokens, 0)
+        return random.uniform(0, min(self.maxWait, ZC_DYDB_BACKOFF * 2 ** attempt))
+
+    def succeeded(self):
+        '''
+        成功したのでrateを予算まで戻していく
+        '''
+        if not self.limit or self.rate >= self.limit:
+            return
+        with self.lock:
+            self.rate = min(self.limit, self.rate * 1.1 + 1)
+
 class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
     '''
     Zabbixのデータ複製操作クラス
@@ -2225,6 +3697,13 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
         self.LOCAL = {}
         # Zabbix IDとZabbix Nameの変換テーブル
         self.IDREPLACE = {}
+        # 前回のLOCAL取得以降にZabbixへ書き込みを行ったメソッド
+        self.WRITTEN = set()
+        # 前回の適用から変更がない（全体/CONFIG_IMPORTセクション）
+        self.UPTODATE = False
+        self.importSkip = False
+        # 今回の実行で失敗したが処理を続けたもの、あればハッシュ値を記録しない
+        self.FAILED = []
         # ノードのZabbixバージョン
         self.VERSION = None
 
@@ -2467,6 +3946,7 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                 # 6.4対応 現在のパスワードが必要
                 if self.VERSION.major >= 6.4:
                     change.update({'current_passwd': currentPasswd})
+                self.markWritten('user')
                 self.ZAPI.user.update(**change)
                 # 変更したパスワードで再認証
                 self.ZAPI.login(*auth)
@@ -2498,7 +3978,8 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                 }
             ]
         else:
-            result = self.getVersionFromStore()
+            # 最新かターゲットバージョンがあれば足りる
+            result = self.getVersionFromStore(self.CONFIG.targetVersion or '', limit=1)
             if result[0]:
                 if self.checkMasterNode():
                     if not self.VERSIONS:
@@ -2574,6 +4055,7 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                         }
                         try:
                             # 適用実行
+                            self.markWritten('host')
                             self.ZAPI.host.update(**option)
                             count['set'] += 1
                         except Exception as e:
@@ -2630,6 +4112,13 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                 PRINT_TAB(2, self.CONFIG.quiet)
                 self.LOGGER.info('Version Information:\n{}{}'.format(TAB*3, info.replace(', ', f'\n{TAB*3}')))
 
+            # 前回の適用から変更がないか確認
+            result = self.checkDigestCode(version)
+            if self.UPTODATE:
+                PRINT_TAB(2, self.CONFIG.quiet)
+                self.LOGGER.info(f'No Changes Since Last Clone: {version}')
+                return result
+
             # 適用状態の確認
             nowVersion = self.LOCAL['usermacro'].get(ZC_VERSION_CODE, None)
             if nowVersion:
@@ -2663,6 +4152,7 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                         function = 'delete'
                         ids = [item['ZABBIX_ID'] for item in self.LOCAL[method].values()]
                         if ids:
+                            self.markWritten(method)
                             try:
                                 getattr(api, function)(*ids)
                                 result = ZC_COMPLETE
@@ -2677,7 +4167,8 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                             self.LOGGER.error('{}: Failed.'.format(method))
                             return result
             else:
-                # 初期化する
+                # 初期化する、テンプレートも削除されるのでインポートはスキップできない
+                self.importSkip = False
                 PRINT_PROG(f'{TAB*2}Start Initialize:\n', self.CONFIG.quiet)
                 process = 'Data Clear'
                 # イニシャライズ対象のメソッド、プロキシ、テンプレート、グループは使っているホストがあると消せないので後回しにする
@@ -2734,6 +4225,7 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                     if method == 'usermacro':
                         function += 'global'
                     if ids != []:
+                        self.markWritten(method)
                         try:
                             getattr(api, function)(*ids)
                             result = ZC_COMPLETE
@@ -2781,7 +4273,7 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                 return result
 
         if result[0]:
-            result = self.getDataFromZabbix()
+            result = self.refreshDataFromZabbix()
         
         return result
 
@@ -4307,22 +5799,43 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
 
         return ZC_COMPLETE
 
-    def getDataFromZabbix(self):
+    def getDataFromZabbix(self, targets=None):
         '''
         実行ノードのZabbixからデータを取得しLOCALに適用
+        メソッドのgetは並列実行、LOCALへの適用はmethodParametersの順で行う
+        targets: 取得するメソッドのリスト、Noneならすべて
         '''
         result = ZC_COMPLETE
+
+        # 取得対象のメソッド
+        methods = {}
+        for method, options in self.methodParameters.items():
+            if targets is not None and method not in targets:
+                continue
+            # メソッドが追加されたバージョン未満ならスキップ
+            if [version for version, addMethods in self.addMethods.items() if self.VERSION.major < version and method in addMethods]:
+                continue
+            # 消えたメソッドはsuper().__init__でmethodParametersから削除されるので処理はない
+            methods[method] = options
+
+        # 並列処理用のget実行ファンクション
+        def getMethodData(method, options):
+            return getattr(self.ZAPI, method).get(**options.get('options', {}))
+
+        # method.getの並列実行、実行数はapiWorkerNum
+        # ZabbixのAPI応答待ちの処理なのでThread*を使う
+        future_list = {}
+        with futures.ThreadPoolExecutor(max_workers=self.CONFIG.apiWorkerNum) as executor:
+            for method, options in methods.items():
+                future_list[method] = executor.submit(getMethodData, method, options)
+
+        method = None
         try:
-            # メソッドIDと名前を取得
-            for method, options in self.methodParameters.items():
-                # メソッドが追加されたバージョン未満ならスキップ
-                for version, addMethods in self.addMethods.items():
-                    if self.VERSION.major < version and method in addMethods:
-                        continue
-                # 消えたメソッドはsuper().__init__でmethodParametersから削除されるので処理はない
-                # methodParamterに登録されているメソッドのデータをget
+            # 取得結果の適用、順番を固定するためmethodParametersの順で処理
+            for method, options in methods.items():
+                # methodParamterに登録されているメソッドのデータ
+                getData = future_list[method].result()
                 self.LOCAL[method] = {}
-                getData = getattr(self.ZAPI, method).get(**options.get('options', {}))
                 if method in self.sections['GLOBAL']:
                     # IDもNAMEもないので特別処理
                     id = 0
@@ -4347,7 +5860,7 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
             result = (False, f'Failed getDataFromZabbix/API {method}.')
 
         # 6.0以前のマスターノードならばデータベース操作でデータ取得
-        if self.checkMasterNode and self.VERSION.major < 6.0:
+        if targets is None and self.checkMasterNode and self.VERSION.major < 6.0:
             try:
                 self.LOCAL['database'] = {}
                 for table in self.sections['DB_DIRECT']:
@@ -4363,9 +5876,12 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                 result = (False, 'Failed getDataFromZabbix/DBDirect.')
 
         # IDREPLACE: ZCを実行しているノードのZabbixから取得した値からの生成
-        IDREPLACE = {}
+        # 一部メソッドの取得の場合はそのメソッドだけ作り直す
+        IDREPLACE = {} if targets is None else self.IDREPLACE
         try:
             for method, data in self.LOCAL.items():
+                if targets is not None and method not in methods:
+                    continue
                 IDREPLACE[method] = {}
                 for item in data.values():
                     # ZABBIX_IDとNAMEがあるものだけ処理
@@ -4377,8 +5893,39 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
             self.LOGGER.debug(e)
             result = (False, 'Failed getDataFromZabbix/IDREPLACE.')
 
+        # 取得したメソッドは書き込み済みから外す
+        if result[0]:
+            self.WRITTEN.difference_update(methods.keys())
+
         return result
 
+    def markWritten(self, *methods):
+        '''
+        Zabbixへ書き込んだメソッドと、それに連動して変わるメソッドを再取得対象にする
+        '''
+        # 再取得しないメソッド（hostinterfaceなど）はWRITTENに残るので、WRITTENではなく今回たどったもので判定する
+        marked = set()
+        methods = list(methods)
+        while methods:
+            method = methods.pop()
+            if method in marked:
+                continue
+            marked.add(method)
+            methods.extend(ZC_WRITTEN_DEPENDS.get(method, []))
+        self.WRITTEN.update(marked)
+
+    def refreshDataFromZabbix(self):
+        '''
+        前回の取得以降に書き込みを行ったメソッドのみZabbixから再取得してLOCAL/IDREPLACEを更新する
+        書き込みがなければ何もしない
+        '''
+        # LOCALで管理していないもの（trigger/hostinterfaceなど）は再取得しないが、書き込みの記録は残す
+        # 連動して変わるメソッドはmarkWritten()で追加済み
+        targets = [method for method in self.WRITTEN if method in self.methodParameters.keys()]
+        if not targets:
+            return ZC_COMPLETE
+        return self.getDataFromZabbix(targets)
+
     def getConfigurationFromZabbix(self):
         '''
         通常のメソッドで取得すると、取得するためのパラメータのバージョン間変更対応が煩雑なため、
@@ -4387,6 +5934,7 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
         # 取得対象のIDを抽出
         exportIds = {}
         templateIds=[]
+        hostIds = []
         convSectionToMethod = {}
         for method, section in self.sections['CONFIG_EXPORT'].items():
             # option->methodの逆引き辞書を作る
@@ -4399,35 +5947,49 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                 if self.CONFIG.templateSkip:
                     continue
                 templateIds = items
+            elif method == 'host':
+                hostIds = items
             else:
                 exportIds.update({section: items})
         
-        exportIds = [exportIds]
+        # 並列処理用のconfiguration.export()実行ファンクション
+        # 区切り数の調整用に(True, データ, 応答データ量)を返す
+        def exportConfiguration(item):
+            data = self.ZAPI.configuration.export(
+                **{
+                    'format': 'json',
+                    'options': item
+                }
+            )
+            # mediatype表記ゆれ対応: 出力のmedia_types（ここでしか出てこない） -> importOption/ExportのmediaTypesに変換 
+            return (True, json.loads(data.replace('media_types', 'mediaTypes')).get('zabbix_export'), len(data))
 
-        # 負荷対策
-        # テンプレートはZC_TEMPLATE_SEPARATEごとに分割して別処理
-        start = loop = 0
-        while len(templateIds) > start:
-            loop += 1
-            count = self.CONFIG.templateSeparate * loop
-            exportIds.append({'templates': templateIds[start:count]})
-            start = count
-
-        # configuration.export()の実行、JSONに変換
         exportData = []
-        for item in exportIds:
-            try:
-                data = self.ZAPI.configuration.export(
-                    **{
-                        'format': 'json',
-                        'options': item
-                    }
-                )
-                # mediatype表記ゆれ対応: 出力のmedia_types（ここでしか出てこない） -> importOption/ExportのmediaTypesに変換 
-                exportData.append(json.loads(data.replace('media_types', 'mediaTypes')).get('zabbix_export'))
-            except Exception as e:
-                self.LOGGER.debug(e)
-                return (False, 'Failed configuration export.')
+        try:
+            exportData.append(exportConfiguration(exportIds)[1])
+        except Exception as e:
+            self.LOGGER.debug(e)
+            return (False, 'Failed configuration export.')
+
+        # 負荷対策
+        # テンプレートはtemplateSeparate、ホストはhostSeparateを初期値にして
+        # 応答のデータ量と時間から区切り数を調整しながらapiWorkerNumで並列実行
+        # 結果は分割した順に並べる
+        for section, ids, separate in [
+            ('templates', templateIds, self.CONFIG.templateSeparate),
+            (self.sections['CONFIG_EXPORT']['host'], hostIds, self.CONFIG.hostSeparate)
+        ]:
+            results = self.executeChunks(
+                self.newChunker(separate),
+                ids,
+                lambda chunk, section=section: exportConfiguration({section: chunk}),
+                workers=self.CONFIG.apiWorkerNum
+            )
+            for result, chunk, data in results:
+                if not result:
+                    self.LOGGER.debug(data)
+                    return (False, 'Failed configuration export.')
+                exportData.append(data)
 
         for data in exportData:
             # configurationから不要データを取り除いて成型
@@ -4538,7 +6100,7 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
         else:
             version = version[0]
         # 継承元クラスの同名ファンクションを使ってストアからデータを取得
-        result = super().getDataFromStore(version)
+        result = super().getDataFromStore(version, methods=params.get('methods'), names=params.get('names'))
         if not result[0]:
             return result
         # ファイルの場合
@@ -4573,6 +6135,8 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
         '''
         # バージョン情報の新規生成
         self.createNewVersion()
+        # メソッドごとのデータのハッシュ値
+        self.NEW['DIGEST'] = json.dumps(self.digestStore())
 
         # DATA
         # 引数は{method: [item,item,...],}
@@ -4584,6 +6148,7 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
         # ファイル出力の場合は終了
         if self.CONFIG.storeType == 'file':
             self.NEW.pop('DESCRIPTION', None)
+            self.NEW.pop('DIGEST', None)
             return (True, self.NEW)
 
         # VERSION
@@ -4778,6 +6343,7 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
 
             # settingsの適用
             if globalSettings:
+                self.markWritten('settings')
                 try:
                     self.ZAPI.settings.update(**globalSettings)
                     PRINT_PROG(f'\r{TAB*2}', self.CONFIG.quiet)
@@ -4797,6 +6363,7 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                             'value': item['value'],
                             'type': 1
                         }
+                        self.markWritten('usermacro')
                         self.ZAPI.usermacro.createglobal(**macro)
                         PRINT_PROG(f'\r{TAB*2}', self.CONFIG.quiet)
                         self.LOGGER.info(f'{process}{subProcess}: Success.')
@@ -4821,11 +6388,106 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
 
         return result
 
+    def indexTriggers(self, triggers):
+        '''
+        トリガー式を一度だけ解析してテンプレート名からトリガーを引く索引を作る
+        複数のテンプレートを参照するトリガーはそれぞれのテンプレートに入る
+        返値: {テンプレート名: [trigger,...]} トリガーの順番は元の順
+        '''
+        if self.getLatestVersion('MASTER_VERSION') >= 5.4:
+            pattern = ZC_TRIGGER_HOST[5.4]
+        else:
+            pattern = ZC_TRIGGER_HOST[4.0]
+        index = {}
+        for trigger in triggers:
+            for name in set(pattern.findall(trigger.get('expression', ''))):
+                index.setdefault(name, []).append(trigger)
+        return index
+
+    def sortTemplateLayers(self, templates):
+        '''
+        テンプレートをリンクの依存関係で階層に分ける（Kahnのトポロジカルソート）
+        階層０：リンクするテンプレートのない
+        階層１：階層０のみリンクしている
+        階層２：階層０，１をリンクしている
+        依存関係はテンプレートのリンクとホストのプロトタイプのテンプレートリンク
+        ストアにないがノードに既にあるテンプレートへのリンクは解決済みとして扱う
+        返値: ({階層: [template,...]}, {解決できないテンプレート名: 理由})
+        '''
+        name = self.getKeynameInMethod('template', 'name')
+
+        # 技術名 -> インデックス、リンクは技術名（template）で書かれる
+        # 表示名で引くと表示名と技術名が違うテンプレートが解決できず、別テンプレートの表示名とも衝突する
+        index = {}
+        for idx, template in enumerate(templates):
+            index[template.get('template', template[name])] = idx
+        # ノードに既にあるテンプレートの技術名
+        localTemplates = set(
+            [item['DATA'].get('host', item['NAME']) for item in self.LOCAL.get('template', {}).values()]
+        )
+
+        # 依存関係の生成
+        depends = [set() for template in templates]
+        children = [[] for template in templates]
+        missing = {}
+        for idx, template in enumerate(templates):
+            links = [link['name'] for link in template.get('templates', [])]
+            for lld in template.get('discovery_rules', []):
+                for ptype in lld.get('host_prototypes', []):
+                    links.extend([item['name'] for item in ptype.get('templates', [])])
+            for link in set(links):
+                if link in index:
+                    if index[link] not in depends[idx]:
+                        depends[idx].add(index[link])
+                        children[index[link]].append(idx)
+                elif link in localTemplates:
+                    # ノードに既にあるテンプレート
+                    continue
+                else:
+                    # どこにもないテンプレート
+                    missing.setdefault(idx, []).append(link)
+
+        # 依存が残っている数、存在しないリンクがあるものは解決しない
+        indegree = [len(depends[idx]) + (1 if idx in missing else 0) for idx in range(len(templates))]
+        layer = [idx for idx in range(len(templates)) if indegree[idx] == 0]
+        groups = {}
+        group = 0
+        while layer:
+            groups[group] = [templates[idx] for idx in layer]
+            nextLayer = []
+            for idx in layer:
+                for child in children[idx]:
+                    indegree[child] -= 1
+                    if indegree[child] == 0:
+                        nextLayer.append(child)
+            # 元の並び順を維持する
+            layer = sorted(nextLayer)
+            group += 1
+
+        # 階層に入らなかったもの：存在しないリンク、循環リンク、それらへの依存
+        unresolved = {}
+        for idx in range(len(templates)):
+            if indegree[idx] == 0:
+                continue
+            if idx in missing:
+                error = 'Missing Linked Template: {}.'.format(', '.join(sorted(missing[idx])))
+            else:
+                links = sorted([templates[link][name] for link in depends[idx] if indegree[link] != 0])
+                error = 'Circular or Unresolved Linked Template: {}.'.format(', '.join(links))
+            unresolved[templates[idx][name]] = error
+
+        return (groups, unresolved)
+
     def setConfigurationToZabbix(self):
         '''
         STOREからZabbixインポートデータの生成、適用
         CONFIG_IMPORTセクション
         '''
+        # 前回の適用からCONFIG_IMPORTのデータに変更がない
+        if self.importSkip:
+            PRINT_TAB(2, self.CONFIG.quiet)
+            self.LOGGER.info('Configuration Import: SKIP, No Changes Since Last Clone.')
+            return ZC_COMPLETE
 
         # バージョン対応のメソッド-セクション対応dictの生成
         sections = {}
@@ -4909,7 +6571,9 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                 importData[section] = [item['DATA'] for item in data]
 
         importData = [importData]
-        triggers = [trigger['DATA'] for trigger in self.STORE.get('trigger', [])] 
+        triggers = [trigger['DATA'] for trigger in self.STORE.get('trigger', [])]
+        # テンプレート名 -> トリガーの索引
+        triggerIndex = self.indexTriggers(triggers)
 
         # valuemap要不要の境界バージョン処理
         if self.VERSION.major >= 5.4 and self.getLatestVersion('MASTER_VERSION') < 5.4:
@@ -4918,62 +6582,39 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
             valueMap = None
 
         # テンプレートの分割処理
-        templateGroup = []
-        group = 0
-        groups = {}
-        processed = []
         templateTotal = len(templates)
-        while templates:
-            groups[group] = []
-            # グループ０：リンクするテンプレートのない
-            # グループ１：グループ０のみリンクしている
-            # グループ２：グループ０，１をリンクしている
-            # …前グループをリンクしているものがなくなるまで繰り返して分類
-            for template in templates.copy():
-                # 6.0以前のテンプレートのグループ対応
-                if template.get('groups'):
-                    templateGroup.extend(template['groups'])
-                # ホストのプロトタイプのテンプレートを確認し、processedになければ飛ばす
-                ptypeTemplate = []
-                for lld in template.get('discovery_rules', []):
-                    for ptype in lld.get('host_prototypes', []):
-                        ptypeTemplate.extend([item['name'] for item in ptype.get('templates', [])])
-                set(ptypeTemplate)
-                if not LISTA_ALL_IN_LISTB(ptypeTemplate, processed):
-                    continue
-                # リンクしているテンプレートが処理済みリストにない
-                links = [link['name'] for link in template.get('templates', [])]
-                if LISTA_ALL_IN_LISTB(links, processed):
-                    # groupに追加
-                    groups[group].append(template)
-                    # 元リストから消す
-                    templates.remove(template)
-            # 処理済みに追加
-            name = self.getKeynameInMethod('template', 'name')
-            processed.extend([template[name] for template in groups[group]])
-            # 次のグループ
-            group += 1
-        # さらにそれぞれのグループをZC_TEMPLATE_SEPARATEずつ分離してimportDataに追加
+        # 6.0以前のテンプレートのグループ対応
+        templateGroup = []
+        for template in templates:
+            if template.get('groups'):
+                templateGroup.extend(template['groups'])
+        # リンクの依存関係で階層に分ける、依存が解決できないものは失敗として扱う
+        groups, unresolved = self.sortTemplateLayers(templates)
+        # さらにそれぞれのグループのテンプレートを1つずつ分離してtemplateImportsにグループごとに追加
         # 一応0から順にソートする
+        templateImports = {}
         count = 0
         for group in sorted(groups.keys()):
             items = groups[group]
-            # インポートエラーが一つでも出ると全部巻き込まれるので、１つずつ入れることにした
+            templateImports[group] = []
+            # インポートエラーが一つでも出ると全部巻き込まれるので、テンプレート単位で作って実行時にまとめる
             count = 0
             while len(items) > count:
                 template = items[count]
                 if self.VERSION.major == 4.2:
                     # 4.2だけこれが消えてる
                     self.importRules['templateLinkage'].pop('deleteMissing', None)
-                if self.getLatestVersion('MASTER_VERSION') >= 5.4:
-                    name = '/%s/' % template['name']
-                else:
-                    name = '{%s:' % template['name']
                 iData= {
                     'templates': [template],
                 }
                 # 対象のテンプレート用のTriggersを追加する
-                templateTriggers = [trigger for trigger in triggers if name in trigger['expression']]
+                # トリガー式はテンプレート名（template）で書かれるので両方の名前で引く
+                templateTriggers = triggerIndex.get(template['name'], [])
+                if template.get('template', template['name']) != template['name']:
+                    added = set([id(trigger) for trigger in templateTriggers])
+                    templateTriggers = templateTriggers + [
+                        trigger for trigger in triggerIndex.get(template['template'], []) if id(trigger) not in added
+                    ]
                 if templateTriggers:
                     iData.update({'triggers': templateTriggers})
                 # ホストプロトタイプのディレクトリ指定がテンプレート内にないとダメっぽいので雑に全部追加
@@ -4987,7 +6628,7 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                         iData.update({'value_maps': valueMap})
                     else:
                         importData[0].pop('value_maps', None)
-                importData.append(iData)
+                templateImports[group].append(iData)
                 count += 1
 
         # ホストグループとテンプレートグループの分離処理
@@ -5005,26 +6646,15 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
             for item in templateGroup:
                 if item in self.LOCAL['templategroup'].keys():
                     continue
+                self.markWritten('templategroup')
                 try:
                     self.ZAPI.templategroup.create(**{'name': item})
                 except Exception as e:
                     self.LOGGER.debug(e)
                     return (False, f'Failed Convert Hostgroup:{item} -> ver.6.2+ Templategroup.')
 
-        # インポートデータ処理
-        # テンプレートとホスト以外を全部処理、次にテンプレートをZC_TEMPLATE_SEPARATEずつ処理、ホストは次のファンクション
-        process = 'Template Import'
-        templateResult = {'total': templateTotal, 'success': 0, 'failed': 0, 'messages': []}
-        PRINT_PROG(f'{TAB*2}{process}:', self.CONFIG.quiet)
-        for importItems in importData:
-            if self.CONFIG.templateSkip and importItems.get('templates'):
-                continue
-            # テンプレート用処理
-            if 'templates' in importItems.keys():
-                # 処理するテンプレートの名前
-                templateProcess = importItems['templates'][0]['name']
-            else:
-                templateProcess = None
+        # インポート実行ファンクション、テンプレートの並列処理でも使う
+        def importConfiguration(importItems):
             importItems.update(
                 {
                     'version': str(self.getLatestVersion('MASTER_VERSION')),
@@ -5039,6 +6669,8 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                 importItems = '{"zabbix_export":%s}' % json.dumps(importItems, ensure_ascii=False)
             except:
                 return (False, 'Failed Convert ImportFile: {}'.format(self.getLatestVersion('VERSION_ID')))
+            # インポートで書き込まれる可能性があるメソッド（hostは別処理、テンプレートなどのリンクで変わる分はmarkWritten()で追加）
+            self.markWritten(*[method for method in sections.keys() if method != 'host'])
             # インポート実行
             try:
                 result = self.ZAPI.configuration.import_(
@@ -5048,41 +6680,91 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                         'source': importItems,
                     }
                 )
-                # テンプレートを処理している場合の結果
-                if templateProcess:
-                    if not result:
-                        templateResult['failed'] += 1
-                        templateResult['message'].append(
-                            {
-                                'name': templateProcess,
-                                'error': 'No Result return.'
-                            }
-                        )
-                    else:
-                        templateResult['success'] += 1
             except Exception as e:
-                if templateProcess:
-                    templateResult['failed'] += 1
-                    templateResult['messages'].append(
-                        {
-                            'name': templateProcess,
-                            'error': e
-                        }
-                    )
-                else:
-                    # テンプレート以外の失敗は即終了
-                    PRINT_PROG(f'\r{TAB*2}', self.CONFIG.quiet)
-                    self.LOGGER.error(f'{process}: Failed.')                    
-                    return (False, f'Failed Execute Import.\n{e}')
-
-            if templateProcess:
-                res = '{}/{} (success:{}/failed:{})'.format(
-                    templateResult['success'] + templateResult['failed'],
-                    templateResult['total'],
-                    templateResult['success'],
-                    templateResult['failed']
+                self.LOGGER.debug(e)
+                return (False, e)
+            return (True, result)
+
+        # インポートデータ処理
+        # テンプレートとホスト以外を全部処理、次にテンプレートをグループごとに処理、ホストは次のファンクション
+        process = 'Template Import'
+        templateResult = {
+            'total': templateTotal,
+            'success': 0,
+            'failed': len(unresolved),
+            'messages': [{'name': name, 'error': error} for name, error in unresolved.items()]
+        }
+        res = '{}/{} (success:0/failed:{})'.format(len(unresolved), templateTotal, len(unresolved))
+        PRINT_PROG(f'{TAB*2}{process}:', self.CONFIG.quiet)
+        for importItems in importData:
+            result = importConfiguration(importItems)
+            if not result[0]:
+                # テンプレート以外の失敗は即終了
+                PRINT_PROG(f'\r{TAB*2}', self.CONFIG.quiet)
+                self.LOGGER.error(f'{process}: Failed.')
+                return (False, f'Failed Execute Import.\n{result[1]}')
+
+        # テンプレート単位のインポートデータのサイズ（区切り数の調整用）
+        importSize = {}
+        def sizeOfImport(iData):
+            if id(iData) not in importSize:
+                importSize[id(iData)] = len(json.dumps(iData, ensure_ascii=False))
+            return importSize[id(iData)]
+
+        # テンプレート単位のインポートデータをまとめて実行
+        # 区切り数の調整用に(boolean, 結果, データ量)を返す
+        def importTemplates(chunk):
+            iData = {'templates': []}
+            added = set()
+            for item in chunk:
+                iData['templates'].extend(item['templates'])
+                for trigger in item.get('triggers', []):
+                    if id(trigger) in added:
+                        continue
+                    added.add(id(trigger))
+                    iData.setdefault('triggers', []).append(trigger)
+                for key in ['groups', 'value_maps']:
+                    if key in item:
+                        iData.setdefault(key, item[key])
+            result = importConfiguration(iData)
+            return (result[0], result[1], sum([sizeOfImport(item) for item in chunk]))
+
+        # 進捗表示
+        def templateProgress(success, chunk, result):
+            nonlocal res
+            if success:
+                templateResult['success'] += len(chunk)
+            else:
+                templateResult['failed'] += len(chunk)
+                templateResult['messages'].extend(
+                    [{'name': iData['templates'][0]['name'], 'error': result} for iData in chunk]
                 )
-                PRINT_PROG(f'\r{TAB*2}{process}: {res}', self.CONFIG.quiet)
+            res = '{}/{} (success:{}/failed:{})'.format(
+                templateResult['success'] + templateResult['failed'],
+                templateResult['total'],
+                templateResult['success'],
+                templateResult['failed']
+            )
+            PRINT_PROG(f'\r{TAB*2}{process}: {res}', self.CONFIG.quiet)
+
+        # テンプレートのインポート
+        # 同じグループ内のテンプレートは互いに依存しないので並列実行、実行数はphp-fpmのフォーク数以下にする
+        # template_separateを初期値に、データ量と応答時間から1回にまとめるテンプレート数を調整する
+        # 失敗したまとまりは分割して再実行し、1つで失敗したものを失敗とする
+        # 次のグループは前のグループのインポートがすべて終わってから実行する
+        templateChunker = self.newChunker(self.CONFIG.templateSeparate)
+        for group in sorted(templateImports.keys()):
+            if self.CONFIG.templateSkip:
+                break
+            self.executeChunks(
+                templateChunker,
+                templateImports[group],
+                importTemplates,
+                workers=self.CONFIG.phpWorkerNum,
+                sizeOf=sizeOfImport,
+                stop=False,
+                progress=templateProgress
+            )
 
         # テンプレートインポートの結果
         if self.CONFIG.templateSkip:
@@ -5094,14 +6776,53 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
             for message in  templateResult['messages']:
                 PRINT_PROG(f'\r{TAB*3}', self.CONFIG.quiet)
                 self.LOGGER.error('Import Error[{}]: {}'.format(message['name'], message['error']))
+            if templateResult['failed']:
+                self.FAILED.append(process)
 
         # テンプレート適用したのでZabbixからデータを取得、IDREPLACEの更新
-        result = self.getDataFromZabbix()
+        result = self.refreshDataFromZabbix()
         if not result[0]:
             return result
 
         return ZC_COMPLETE
 
+    def projectData(self, data, local):
+        '''
+        ローカルのデータを適用データにあるキーだけに絞る
+        getで返ってくるだけのキー（IDなど）を比較対象から外すため
+        リストの中のdictは適用データのリストの全要素のキーで絞る
+        '''
+        if isinstance(data, dict) and isinstance(local, dict):
+            return {key: self.projectData(value, local[key]) for key, value in data.items() if key in local}
+        if isinstance(data, list) and isinstance(local, list):
+            template = {}
+            for item in data:
+                if isinstance(item, dict):
+                    template.update(item)
+            if template:
+                return [self.projectData(template, item) for item in local]
+        return local
+
+    def fingerprintData(self, data):
+        '''
+        データの内容のハッシュ値
+        getの返値は全部文字列なので値は文字列にそろえる、リストは順番に依存しないように並べ替える
+        '''
+        def normalize(value):
+            if isinstance(value, dict):
+                return {key: normalize(val) for key, val in value.items()}
+            if isinstance(value, (list, tuple)):
+                return sorted(
+                    [normalize(val) for val in value],
+                    key=lambda x: json.dumps(x, sort_keys=True, ensure_ascii=False)
+                )
+            if value is None:
+                return ''
+            return str(value)
+        return hashlib.sha1(
+            json.dumps(normalize(data), sort_keys=True, ensure_ascii=False).encode()
+        ).hexdigest()
+
     def setApiToZabbix(self, section):
         '''
         STOREからAPIでZabbixにデータを適用する
@@ -5161,15 +6882,26 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                             # LOCALにあるものはupdate、ZABBIX_IDをDATAの中に入れる
                             idName = self.getKeynameInMethod(method, 'id')
                             data[idName] = self.LOCAL[method][name]['ZABBIX_ID']
-                            items.append({'update': data})
+                            # 適用データのキーでLOCALと比較して同じ内容ならupdateしない
+                            # LOCALにないキー（パスワードなど）があれば一致しないのでupdateする
+                            local = self.projectData(data, self.LOCAL[method][name].get('DATA', {}))
+                            if self.fingerprintData(data) == self.fingerprintData(local):
+                                items.append({'skip': data})
+                            else:
+                                items.append({'update': data})
                         else:
                             # LOCALにないものはcreate
                             items.append({'create': data})
             
             # 実行
-            execResult = {'total': len(items),'create': 0, 'update': 0, 'delete': 0}
+            # 同じファンクションが連続するものをまとめて配列で実行する（実行順は変えない）
+            runs = []
+            skip = 0
             for item in items:
-                if item.get('update'):
+                if item.get('skip'):
+                    skip += 1
+                    continue
+                elif item.get('update'):
                     function = 'update'
                 elif item.get('create'):
                     function = 'create'
@@ -5177,33 +6909,47 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                     function = 'delete'
                 else:
                     continue
-                item = item[function]
-                execResult[function] += 1
-                # usermacroのグローバルマクロはファンクションにglobalがつくので加工
-                if method == 'usermacro':
-                    function += 'global'
-                try:
-                    if function == 'delete':
-                        if self.CONFIG.noDelete:
-                            continue
-                        getattr(api, function)(item)
-                    else:
-                        getattr(api, function)(**item)
-                except Exception as e:
-                    self.LOGGER.debug(e)
-                    result = (False, 'setApiToZabbix, {} {}.'.format(method.replace('Extend', ''), function))
+                if runs and runs[-1][0] == function:
+                    runs[-1][1].append(item[function])
+                else:
+                    runs.append((function, [item[function]]))
 
-                res = '{}[{}]: {}/{} (create:{}/update:{}/delete:{})'.format(
+            execResult = {'total': len(items),'create': 0, 'update': 0, 'delete': 0, 'skip': skip}
+
+            # 進捗表示
+            def progress(function, results):
+                execResult[function] += len(results)
+                res = '{}[{}]: {}/{} (create:{}/update:{}/delete:{}/skip:{})'.format(
                     process,
                     method,
-                    execResult['create'] + execResult['update'] + execResult['delete'],
+                    execResult['create'] + execResult['update'] + execResult['delete'] + execResult['skip'],
                     execResult['total'],
                     execResult['create'],
                     execResult['update'],
-                    execResult['delete']
+                    execResult['delete'],
+                    execResult['skip']
                 )
                 PRINT_PROG(f'\r{TAB*3}{res}', self.CONFIG.quiet)
-                if not result[0]:
+                return res
+
+            res = progress('skip', [])
+            for function, runItems in runs:
+                if function == 'delete' and self.CONFIG.noDelete:
+                    # 削除しない設定なので実行せずにカウントだけ進める
+                    res = progress(function, runItems)
+                    continue
+                # usermacroのグローバルマクロはファンクションにglobalがつくので加工
+                apiFunction = function + 'global' if method == 'usermacro' else function
+                self.markWritten(method.replace('Extend', ''))
+                results = self.executeApiBatch(
+                    api,
+                    apiFunction,
+                    runItems,
+                    progress=lambda results: progress(function, results)
+                )
+                res = progress(function, [])
+                if not all([item[0] for item in results]):
+                    result = (False, 'setApiToZabbix, {} {}.'.format(method.replace('Extend', ''), apiFunction))
                     return result
             PRINT_PROG(f'\r{TAB*3}', self.CONFIG.quiet)
             if items:
@@ -5213,11 +6959,176 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
             # Zabbixの適用が終わってないことがあったので待機を追加
             sleep(1)
 
-        # API実行が終わったらローカルを更新
-        self.getDataFromZabbix()
+        # API実行が終わったら書き込みのあったメソッドのローカルを更新
+        self.refreshDataFromZabbix()
 
         return ZC_COMPLETE
 
+    def newChunker(self, count):
+        '''
+        設定の調整範囲で区切り数の自動調整インスタンスを作る
+        '''
+        return ZabbixCloneChunker(
+            count,
+            minCount=self.CONFIG.separateMin,
+            maxCount=self.CONFIG.separateMax,
+            targetBytes=self.CONFIG.separateBytes,
+            targetSec=self.CONFIG.separateSec
+        )
+
+    def executeChunks(self, chunker, items, execute, workers=1, sizeOf=None, stop=True, progress=None):
+        '''
+        itemsをchunkerの区切り数で分割しながら並列実行する
+        実行するたびにデータ量と応答時間をchunkerに返して次の区切り数を調整する
+        失敗したまとまりは半分ずつ再実行し、1件で失敗したものを失敗とする
+        タイムアウトやサイズ超過で失敗した場合は区切り数も減らす
+        execute: まとまりを受け取って(boolean, 結果またはエラー, データ量)を返すファンクション
+        workers: 並列実行数
+        sizeOf: 実行前にデータ量が分かる場合のデータ量取得ファンクション
+        stop: 失敗したものがあったら以降の実行をしない
+        progress: (boolean, まとまり, 結果)を受け取る進捗表示用ファンクション
+        返値: [(boolean, まとまり, 結果またはエラー),...] itemsの順
+        '''
+        def timed(chunk):
+            start = monotonic()
+            success, result, size = execute(chunk)
+            return (success, result, size, monotonic() - start)
+
+        # 未実行のまとまり（先頭位置, アイテム）、先頭位置の順に取り出す
+        pending = [(0, list(items))] if items else []
+        running = {}
+        done = {}
+        failed = False
+        with futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            while running or (pending and not failed):
+                while pending and not failed and len(running) < max(1, workers):
+                    start, segment = heapq.heappop(pending)
+                    count = chunker.nextCount(segment, sizeOf)
+                    if segment[count:]:
+                        heapq.heappush(pending, (start + count, segment[count:]))
+                    running[executor.submit(timed, segment[:count])] = (start, segment[:count])
+                finished, _ = futures.wait(list(running.keys()), return_when=futures.FIRST_COMPLETED)
+                for future in finished:
+                    start, chunk = running.pop(future)
+                    try:
+                        success, result, size, elapsed = future.result()
+                        if not success:
+                            error = result
+                        elif not result:
+                            error = 'No Result return.'
+                        else:
+                            error = None
+                    except Exception as e:
+                        self.LOGGER.debug(e)
+                        result = None
+                        error = e
+                    if error is None:
+                        chunker.feedback(len(chunk), size, elapsed)
+                        done[start] = (True, chunk, result)
+                    elif len(chunk) > 1:
+                        # 半分ずつ再実行して失敗したものを特定する
+                        # タイムアウトやサイズ超過の場合だけ以降の区切り数も減らす
+                        if chunker.overload(error):
+                            chunker.shrink(len(chunk))
+                        half = len(chunk) // 2
+                        heapq.heappush(pending, (start, chunk[:half]))
+                        heapq.heappush(pending, (start + half, chunk[half:]))
+                        continue
+                    else:
+                        done[start] = (False, chunk, error)
+                        failed = stop
+                    if progress:
+                        progress(*done[start])
+
+        return [done[start] for start in sorted(done.keys())]
+
+    def executeApiBatch(self, api, function, items, stop=True, progress=None, workers=1, size=None, group=None):
+        '''
+        create/update/deleteを配列にまとめて実行する
+        size（指定がなければCONFIG.apiBatchSize）ごとに分割して実行し、失敗したまとまりは半分に分割して再実行、失敗したアイテムを特定する
+        ZabbixのAPIは1回の実行の中で1つでも失敗すると全体が適用されないので再実行できる
+        api: ZabbixAPIのメソッドオブジェクト
+        function: 実行するファンクション名
+        items: 実行するアイテム（create/updateはdict、deleteはID）のリスト
+        stop: 失敗したアイテムがあったらそれ以降は実行しない
+        progress: 実行したアイテムの結果を受け取る進捗表示用ファンクション
+        workers: 分割したまとまりの並列実行数、並列実行時のprogressはまとまりごと
+        size: まとめる数
+        group: アイテム -> キーのファンクション、同じキーのアイテムは分割せずに1回で実行する（sizeを超えても分けない）
+        返値: [(boolean, item, error),...] 実行したアイテムの順
+        '''
+        # 分割の単位、groupの指定があれば同じキーのアイテムをまとめる
+        units = []
+        if group:
+            keys = {}
+            for item in items:
+                key = group(item)
+                if key not in keys:
+                    keys[key] = []
+                    units.append(keys[key])
+                keys[key].append(item)
+        else:
+            units = [[item] for item in items]
+
+        def execute(chunk, results, progress):
+            chunkItems = [item for unit in chunk for item in unit]
+            try:
+                getattr(api, function)(*chunkItems)
+                chunkResults = [(True, item, None) for item in chunkItems]
+                results.extend(chunkResults)
+                if progress:
+                    progress(chunkResults)
+                return True
+            except Exception as e:
+                self.LOGGER.debug(e)
+                if len(chunk) == 1:
+                    chunkResults = [(False, item, e) for item in chunkItems]
+                    results.extend(chunkResults)
+                    if progress:
+                        progress(chunkResults)
+                    return False
+            # 半分ずつ再実行して失敗したアイテムを探す
+            half = len(chunk) // 2
+            success = execute(chunk[:half], results, progress)
+            if not success and stop:
+                return False
+            return execute(chunk[half:], results, progress) and success
+
+        size = max(1, size or self.CONFIG.apiBatchSize)
+        chunks = []
+        for unit in units:
+            if chunks and sum([len(item) for item in chunks[-1]]) + len(unit) <= size:
+                chunks[-1].append(unit)
+            else:
+                chunks.append([unit])
+        results = []
+        if workers > 1 and len(chunks) > 1:
+            # 並列実行、進捗表示と結果の集計はメインスレッドで行う
+            def executeChunk(chunk):
+                chunkResults = []
+                execute(chunk, chunkResults, None)
+                return chunkResults
+            with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                future_list = [executor.submit(executeChunk, chunk) for chunk in chunks]
+                for future in futures.as_completed(future_list):
+                    if future.cancelled():
+                        continue
+                    chunkResults = future.result()
+                    if progress:
+                        progress(chunkResults)
+                    if stop and not all([result[0] for result in chunkResults]):
+                        # 未実行のまとまりは取り消す
+                        for item in future_list:
+                            item.cancel()
+            for future in future_list:
+                if not future.cancelled():
+                    results.extend(future.result())
+        else:
+            for chunk in chunks:
+                if not execute(chunk, results, progress) and stop:
+                    break
+        return results
+
     def setHostToZabbix(self):
         '''
         STOREデータを加工し、Zabbixへhostを適用する
@@ -5426,20 +7337,10 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
         hostResult = {'total': len(hosts), 'create': 0, 'update': 0, 'failed': 0}
         process = 'Host Import'
 
-        # 並列処理用のホスト作成ファンクション
-        def importHost(host):
-            function = host['function']
-            name = host['name']
-            data = host['data']
-            try:
-                getattr(self.ZAPI.host, function)(**data)
-                hostResult[function] += 1
-                result = (True, function)
-            except Exception as e:
-                self.LOGGER.debug(e)
-                # hostはインポート失敗しても止めずに進める
-                hostResult['failed'] += 1
-                result = (False, function, name)
+        # 進捗表示
+        def hostProgress(function, results):
+            for result in results:
+                hostResult[function if result[0] else 'failed'] += 1
             res = '{}/{} (create:{}/update:{}/failed:{})'.format(
                 hostResult['create'] + hostResult['update'] + hostResult['failed'],
                 hostResult['total'],
@@ -5448,16 +7349,30 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                 hostResult['failed']
             )
             PRINT_PROG(f'\r{TAB*2}{process}: {res}', self.CONFIG.quiet)
-            return result
 
-        # host.createの並列実行、実行数はphp-fpmのフォーク数以下にする
-        # ZabbixのAPI応答ベースの処理なのでProcess*じゃなくてThread*を使ってる
-        future_list = []
-        with futures.ThreadPoolExecutor(max_workers=self.CONFIG.phpWorkerNum) as executor:
-            for host in hosts:
-                future = executor.submit(importHost, host)
-                future_list.append(future)
-        futures.as_completed(fs=future_list)
+        # host.create/updateはhostBatchSizeごとに配列にまとめて並列実行、実行数はphp-fpmのフォーク数以下にする
+        # まとめた実行が失敗した場合は分割して再実行し、失敗したホストを特定する
+        # hostはインポート失敗しても止めずに進める
+        failedHost = []
+        for function in ['create', 'update']:
+            targets = [host for host in hosts if host['function'] == function]
+            if not targets:
+                continue
+            # 結果のデータからホストを引く
+            hostNames = {id(host['data']): host['name'] for host in targets}
+            self.markWritten('host')
+            results = self.executeApiBatch(
+                self.ZAPI.host,
+                function,
+                [host['data'] for host in targets],
+                stop=False,
+                progress=lambda results, function=function: hostProgress(function, results),
+                workers=self.CONFIG.phpWorkerNum,
+                size=self.CONFIG.hostBatchSize
+            )
+            failedHost.extend(
+                [(False, function, hostNames[id(result[1])]) for result in results if not result[0]]
+            )
 
         res = '{}/{} (create:{}/update:{}/failed:{})'.format(
             hostResult['create'] + hostResult['update'] + hostResult['failed'],
@@ -5469,8 +7384,8 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
         PRINT_PROG(f'\r{TAB*2}', self.CONFIG.quiet)
         self.LOGGER.info(f'{process}: {res}')
 
-        failedHost = [item._result for item in future_list if not item._result[0]]
         if failedHost:
+            self.FAILED.append(process)
             PRINT_PROG(f'{TAB*2}Failed Hosts:\n', self.CONFIG.quiet)
             for item in failedHost:
                 PRINT_TAB(3, self.CONFIG.quiet)
@@ -5478,7 +7393,6 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
             failedHost = [item[2] for item in failedHost]
 
         # インターフェイスのアップデート
-        deleteInterfaces = []
         if ifUpdateHosts:
 
             # 表示（仮）
@@ -5486,27 +7400,62 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
             interfaceResult = {'total':0, 'update':0, 'delete': 0, 'failed': 0, 'skip': 0}
             PRINT_PROG(f'{TAB*2}{process}:', self.CONFIG.quiet)
 
-            idName = self.getKeynameInMethod('host', 'id')
+            def interfaceProgress(results=()):
+                for result in results:
+                    interfaceResult[result[0]] += 1
+                res = '{}/{} (update:{}/delete:{}/skip:{}/failed:{})'.format(
+                    interfaceResult['update'] + interfaceResult['delete'] + interfaceResult['skip'] + interfaceResult['failed'],
+                    interfaceResult['total'],
+                    interfaceResult['update'],
+                    interfaceResult['delete'],
+                    interfaceResult['skip'],
+                    interfaceResult['failed']
+                )
+                PRINT_PROG(f'\r{TAB*2}{process}: {res}', self.CONFIG.quiet)
+                return res
+
+            # 対象ホストのインターフェイスをまとめて取得してhostidごとに分ける
+            # 取得はapiBatchSizeのホストごとに分割してapiWorkerNumで並列実行
+            hostIds = [host['id'] for host in ifUpdateHosts]
+            size = max(1, self.CONFIG.apiBatchSize)
+            hostIfsAll = {}
+            getFailed = set()
+            def getInterfaces(ids):
+                return self.ZAPI.hostinterface.get(
+                    **{
+                        'output': 'extend',
+                        'hostids': ids
+                    }
+                )
+            with futures.ThreadPoolExecutor(max_workers=self.CONFIG.apiWorkerNum) as executor:
+                future_list = {
+                    executor.submit(getInterfaces, hostIds[start:start + size]): hostIds[start:start + size]
+                        for start in range(0, len(hostIds), size)
+                }
+                for future in futures.as_completed(future_list):
+                    try:
+                        for hostIf in future.result():
+                            hostIfsAll.setdefault(str(hostIf['hostid']), []).append(hostIf)
+                    except Exception as e:
+                        self.LOGGER.debug(e)
+                        getFailed.update([str(hostId) for hostId in future_list[future]])
+
+            updateInterfaces = []
+            deleteInterfaces = []
+            # インターフェイスID -> ホストID、同じホストのインターフェイスは1回のAPIでまとめて実行する
+            ifHosts = {}
             for host in ifUpdateHosts:
 
                 hostId = host['id']
                 hostName = host['host']
-                
-                try:
-                    # インターフェイスの取得
-                    hostIfs = self.ZAPI.hostinterface.get(
-                        **{
-                            'output': 'extend',
-                            'hostids': hostId
-                        }
-                    )
-                    interfaceResult['total'] += len(hostIfs)
-                except Exception as e:
-                    self.LOGGER.debug(e)
+
+                if str(hostId) in getFailed:
                     # 現状のホストのインターフェイス情報取得失敗
                     interfaceResult['total'] += 1
                     interfaceResult['failed'] += 1
                     continue
+                hostIfs = hostIfsAll.get(str(hostId), [])
+                interfaceResult['total'] += len(hostIfs)
 
                 # インターフェイスの確認
                 types = [item['type'] for item in hostIfs]
@@ -5557,61 +7506,42 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                         interfaceResult['skip'] += 1
                         continue
                     updateIf['interfaceid'] = targetIf['interfaceid']
-                    try:
-                        result = self.ZAPI.hostinterface.update(**updateIf)
-                        interfaceResult['update'] += 1
-                    except Exception as e:
-                        self.LOGGER.debug(e)
-                        interfaceResult['failed'] += 1
-
-                    res = '{}/{} (update:{}/delete:0/skip:{}/failed:{})'.format(
-                        process,
-                        interfaceResult['update'] + interfaceResult['skip'] + interfaceResult['failed'],
-                        interfaceResult['total'],
-                        interfaceResult['update'],
-                        interfaceResult['delete'],
-                        interfaceResult['skip'],
-                        interfaceResult['failed']
-                    )
-                    PRINT_PROG(f'\r{TAB*2}{process}: {res}', self.CONFIG.quiet)
+                    updateInterfaces.append(updateIf)
+                    ifHosts[str(targetIf['interfaceid'])] = str(hostId)
 
                 for hostIf in hostIfs:
                     # 削除対象の処理
-                    deleteInterfaces.append(
-                        {
-                            'name': '%s(%s)' % (hostName, ZABBIX_IFTYPE[int(hostIf['type'])]),
-                            'id': hostIf['interfaceid']
-                        }
-                    )
-        else:
-            pass
-        
-        if deleteInterfaces:
-            for delIf in deleteInterfaces:
-                name = delIf['name']
-                try:
-                    self.ZAPI.hostinterface.delete(delIf['id'])
-                    interfaceResult['delete'] += 1
-                except Exception as e:
-                    self.LOGGER.debug(e)
-                    interfaceResult['failed'] += 1
-
-                res = '{}/{} (update:{}/delete:0/skip:{}/failed:{})'.format(
-                    process,
-                    interfaceResult['update'] + interfaceResult['skip'] + interfaceResult['failed'],
-                    interfaceResult['total'],
-                    interfaceResult['update'],
-                    interfaceResult['delete'],
-                    interfaceResult['skip'],
-                    interfaceResult['failed']
+                    deleteInterfaces.append(hostIf['interfaceid'])
+                    ifHosts[str(hostIf['interfaceid'])] = str(hostId)
+
+            # 更新と削除はapiBatchSizeごとにまとめてphpWorkerNumで並列実行
+            # Zabbixはホストごとにメインインターフェイスを確認するので、同じホストのインターフェイスは分けずに1回で実行する
+            # 失敗したまとまりはホスト単位で分割して再実行するので、失敗数はインターフェイス単位
+            res = interfaceProgress()
+            for function, items in [('update', updateInterfaces), ('delete', deleteInterfaces)]:
+                if not items:
+                    continue
+                self.markWritten('hostinterface')
+                self.executeApiBatch(
+                    self.ZAPI.hostinterface,
+                    function,
+                    items,
+                    stop=False,
+                    progress=lambda results, function=function: interfaceProgress(
+                        [(function if result[0] else 'failed',) for result in results]
+                    ),
+                    workers=self.CONFIG.phpWorkerNum,
+                    group=lambda item: ifHosts[str(item['interfaceid'] if isinstance(item, dict) else item)]
                 )
-                PRINT_PROG(f'\r{TAB*2}{process}: {res}', self.CONFIG.quiet)
+            res = interfaceProgress()
 
             PRINT_PROG(f'\r{TAB*2}', self.CONFIG.quiet)
             self.LOGGER.info(f'{process}: {res}')
+            if interfaceResult['failed']:
+                self.FAILED.append(process)
 
-        # Zabbixからのデータ再取得
-        self.getDataFromZabbix()            
+        # Zabbixからのデータ再取得（書き込みのあったメソッドのみ）
+        self.refreshDataFromZabbix()
 
         # ホスト削除
         if not self.CONFIG.noDelete:
@@ -5628,14 +7558,16 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
             if deleteTarget:
                 process = 'Host Delete'
                 PRINT_TAB(2, self.CONFIG.quiet)
+                self.markWritten('host')
                 try:
                     self.ZAPI.host.delete(*deleteTarget)
                     self.LOGGER.info('{}: Success.\n{}'.format(process, '/'.join(targetHosts)))
-                    # Zabbixからのデータ再取得
-                    self.getDataFromZabbix()
+                    # Zabbixからのデータ再取得（書き込みのあったメソッドのみ）
+                    self.refreshDataFromZabbix()
                 except Exception as e:
                     self.LOGGER.debug(e)
                     self.LOGGER.error(f'{process}: Failed.')
+                    self.FAILED.append(process)
 
         # 監視する対象がないので終了
         if not hosts:
@@ -5680,6 +7612,7 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                 self.CONFIG.storeConnect['direct_endpoint']
             )
         process = 'Set VersionCode Globalmacro'
+        self.markWritten('usermacro')
         try:
             getattr(self.ZAPI.usermacro, function)(**data)
             PRINT_TAB(2, self.CONFIG.quiet)
@@ -5690,6 +7623,162 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
             return (False, f'Failed {function}, Version:{version}.')
         return ZC_COMPLETE
 
+    def digestData(self, items):
+        '''
+        [(名前, データ),...]のハッシュ値
+        '''
+        items = sorted(items, key=lambda x:str(x[0]))
+        return hashlib.sha1(
+            json.dumps(items, sort_keys=True, ensure_ascii=False, default=str).encode()
+        ).hexdigest()
+
+    def digestStore(self):
+        '''
+        STOREのメソッドごとのハッシュ値
+        返値: {method: hash}
+        '''
+        return {
+            method: self.digestData([(item['NAME'], item['DATA']) for item in items if 'NAME' in item])
+                for method, items in self.STORE.items()
+        }
+
+    def digestLocal(self):
+        '''
+        LOCALのメソッドごとのハッシュ値、ZCの管理用マクロは除く
+        返値: {method: hash}
+        '''
+        digest = {}
+        for method, items in self.LOCAL.items():
+            digest[method] = self.digestData(
+                [
+                    (name, item.get('DATA')) for name, item in items.items()
+                        if not (method == 'usermacro' and name in [ZC_VERSION_CODE, ZC_DIGEST_CODE])
+                ]
+            )
+        return digest
+
+    def makeDigestCode(self, version):
+        '''
+        ワーカーの状態のハッシュ値を作る
+        全体: 適用バージョン + 処理設定 + LOCAL全体
+        CONFIG_IMPORT: マスターのCONFIG_IMPORTメソッドのハッシュ値 + 処理設定 + LOCALのCONFIG_IMPORTメソッド
+        LOCALのhost/templateは複製で書き込む項目とリンク、マクロ、アイテムなどの数を取得しているので、中身の変更もある程度検出する
+        マスターのハッシュ値がないバージョン（ファイルストアなど）のCONFIG_IMPORTは空文字
+        返値: (全体, CONFIG_IMPORT)
+        '''
+        local = self.digestLocal()
+        options = [
+            self.CONFIG.hostUpdate,
+            self.CONFIG.forceHostUpdate,
+            self.CONFIG.noDelete,
+            self.CONFIG.templateSkip,
+        ]
+        stateCode = self.digestData(
+            [
+                ('VERSION_ID', version),
+                ('OPTIONS', options),
+                ('LOCAL', local),
+            ]
+        )
+        master = [item for item in self.VERSIONS if item['VERSION_ID'] == version]
+        try:
+            master = json.loads(master[0].get('DIGEST') or '{}') if master else {}
+        except:
+            master = {}
+        if not master:
+            return (stateCode, '')
+        methods = set([method for imports in self.sections['CONFIG_IMPORT'].values() for method in imports.values()])
+        importCode = self.digestData(
+            [
+                ('MASTER', {method: master.get(method) for method in methods}),
+                ('OPTIONS', options),
+                ('LOCAL', {method: local.get(method) for method in methods}),
+            ]
+        )
+        return (stateCode, importCode)
+
+    def checkDigestCode(self, version):
+        '''
+        前回の適用時に記録したハッシュ値と今の状態を比較する
+        バージョンとワーカーの状態が同じならself.UPTODATE、CONFIG_IMPORTのデータが同じならself.importSkip
+        '''
+        if not self.CONFIG.skipUnchanged or self.CONFIG.updatePassword != 'NO':
+            return ZC_COMPLETE
+        if self.CONFIG.storeType == 'direct':
+            # マスター直接適用はバージョンが毎回変わる
+            return ZC_COMPLETE
+        versionCode = self.LOCAL['usermacro'].get(ZC_VERSION_CODE)
+        digestCode = self.LOCAL['usermacro'].get(ZC_DIGEST_CODE)
+        if not versionCode or not digestCode:
+            return ZC_COMPLETE
+        nowState, _, nowImport = digestCode['DATA'].get('value', '').partition(':')
+        stateCode, importCode = self.makeDigestCode(version)
+        if versionCode['DATA'].get('value') == version and nowState == stateCode:
+            self.UPTODATE = True
+            return (True, 'Already Up To Date.')
+        if importCode and nowImport == importCode:
+            self.importSkip = True
+        return ZC_COMPLETE
+
+    def setDigestCode(self):
+        '''
+        適用後のワーカーの状態のハッシュ値をグローバルマクロに記録する
+        次回の実行でcheckDigestCode()で比較する
+        '''
+        if self.checkMasterNode() or self.CONFIG.storeType == 'direct':
+            return ZC_COMPLETE
+        idName = self.getKeynameInMethod('usermacro', 'id')
+        digestCode = self.LOCAL['usermacro'].get(ZC_DIGEST_CODE)
+        if self.FAILED or not self.CONFIG.skipUnchanged:
+            # 失敗したものがあれば次回は変更がなくても再実行する、スキップしない設定なら記録しない
+            # 前回のハッシュ値が残っていると比較されるので消す
+            process = 'Clear DigestCode Globalmacro'
+            if self.FAILED:
+                PRINT_TAB(2, self.CONFIG.quiet)
+                self.LOGGER.info('Skip DigestCode, Failed: {}.'.format(', '.join(self.FAILED)))
+            if not digestCode:
+                return ZC_COMPLETE
+            self.markWritten('usermacro')
+            try:
+                self.ZAPI.usermacro.deleteglobal(digestCode['ZABBIX_ID'])
+                PRINT_TAB(2, self.CONFIG.quiet)
+                self.LOGGER.info(f'{process}: Success')
+            except Exception as e:
+                self.LOGGER.debug(e)
+                PRINT_PROG(f'{process}: Failed', self.CONFIG.quiet)
+                return (False, 'Failed deleteglobal, Digest.')
+            return ZC_COMPLETE
+        # 適用後の状態を取得
+        result = self.refreshDataFromZabbix()
+        if not result[0]:
+            return result
+        digest = '%s:%s' % self.makeDigestCode(self.getLatestVersion('VERSION_ID'))
+
+        digestCode = self.LOCAL['usermacro'].get(ZC_DIGEST_CODE)
+        if digestCode:
+            function = 'updateglobal'
+            data = {
+                idName: digestCode['ZABBIX_ID'],
+                'value': digest,
+            }
+        else:
+            function = 'createglobal'
+            data = {
+                'macro': ZC_DIGEST_CODE,
+                'value': digest,
+            }
+        process = 'Set DigestCode Globalmacro'
+        self.markWritten('usermacro')
+        try:
+            getattr(self.ZAPI.usermacro, function)(**data)
+            PRINT_TAB(2, self.CONFIG.quiet)
+            self.LOGGER.info(f'{process}: Success')
+        except Exception as e:
+            self.LOGGER.debug(e)
+            PRINT_PROG(f'{process}: Failed', self.CONFIG.quiet)
+            return (False, f'Failed {function}, Digest:{digest}.')
+        return ZC_COMPLETE
+
     def createNewData(self):
 
         '''
@@ -5731,7 +7820,7 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                 if method == 'role' and item['ZABBIX_ID'] == ZABBIX_SUPER_ROLE:
                     continue
                 # マスター側のバージョンコードはここではいらないので抜く
-                if method == 'usermacro' and item['NAME'] == ZC_VERSION_CODE:
+                if method == 'usermacro' and item['NAME'] in [ZC_VERSION_CODE, ZC_DIGEST_CODE]:
                     continue
                 # ZABBIX_IDはLOCALのものなのでSTOREには不要なので捨てる
                 items.append(
@@ -5810,6 +7899,7 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
         # 既存のアップデート中アラート停止の有無を確認、あれば削除
         process = 'Set AlartStop in Update'
         exists = [item['ZABBIX_ID'] for item in self.LOCAL['maintenance'].values() if item['NAME'] == ZC_MAINTE_NAME]
+        self.markWritten('maintenance')
         if exists:
             try:
                 API.delete(*exists)
@@ -5828,8 +7918,8 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
         PRINT_TAB(2, self.CONFIG.quiet)
         self.LOGGER.info(f'{process}: Success.')
         
-        # Zabbixからのデータ再取得
-        self.getDataFromZabbix()
+        # Zabbixからのデータ再取得（書き込みのあったメソッドのみ）
+        self.refreshDataFromZabbix()
 
         PRINT_TAB(2, self.CONFIG.quiet)
         self.LOGGER.info(f'{process}: Start from NOW to {period}s after.')
@@ -5931,6 +8021,7 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
         for user, data in userMediasData.items():
             process = 'API Execute[user.mediatype]'
             PRINT_TAB(2, self.CONFIG.quiet)
+            self.markWritten('user')
             try:
                 self.ZAPI.user.update(**data)
                 self.LOGGER.info(f'{process}: Success.')
@@ -5992,6 +8083,7 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                     if ldapParams.get('host'):
                         process = 'Move LDAP Setting -> UserDirectory'
                         PRINT_TAB(3, self.CONFIG.quiet)
+                        self.markWritten('userdirectory')
                         try:
                             res = self.ZAPI.userdirectory.create(**ldapParams)
                             data['ldap_auth_enabled'] = 1
@@ -6000,6 +8092,7 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                         except:
                             data['ldap_auth_enabled'] = 0
                             self.LOGGER.error(f'{process}: Failed.')
+                            self.FAILED.append(process)
 
         # 6.4対応
         if self.VERSION.major >= 6.4:
@@ -6025,12 +8118,14 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                     if samlParams.get('idp_entityid'):
                         process = 'Move SAML Setting -> UserDirectory'
                         PRINT_TAB(3, self.CONFIG.quiet)
+                        self.markWritten('userdirectory')
                         try:
                             res = self.ZAPI.userdirectory.create(**samlParams)
                             self.LOGGER.info(f'{process}: Success.')
                         except:
                             data['saml_auth_enabled'] = 0
                             self.LOGGER.error(f'{process}: Failed.')
+                            self.FAILED.append(process)
             # LDAP利用しない
             if int(data.get('ldap_auth_enabled', 0)) == 0:
                 ldap = False
@@ -6080,6 +8175,7 @@ class ZabbixClone(ZabbixCloneParameter, ZabbixCloneDatastore):
                 data.pop(property, None)
                 PRINT_TAB(3, self.CONFIG.quiet)
                 self.LOGGER.info(f'Drop Parameters for ZabbixCloud[{property}]: Done.')
+        self.markWritten('authentication')
         try:
             self.ZAPI.authentication.update(**data)
         except Exception as e:
@@ -6234,8 +8330,8 @@ def inputParameters():
     )
     parser.add_argument(
         'command',
-        choices=['clone', 'showversions', 'showdata'],
-        help='clone: Execute Cloning, showversions: show versions in store, showdata: show version\'s data(requierd ---version)'
+        choices=['clone', 'showversions', 'showdata', 'benchmark'],
+        help='clone: Execute Cloning, showversions: show versions in store, showdata: show version\'s data(requierd ---version), benchmark: compare store codecs on version\'s data'
     )
     parser.add_argument(
         '-l', '--log-level',
@@ -6331,6 +8427,11 @@ def inputParameters():
         const='YES',
         help='ワーカーノードを強制初期化する'
     )
+    processingGroup.add_argument(
+        '--skip-unchanged',
+        choices=['YES', 'NO'],
+        help='前回の複製から変更がなければ処理をスキップする（デフォルト: NO）'
+    )
     processingGroup.add_argument(
         '--force-useip',
         action='store_const',
@@ -6372,6 +8473,32 @@ def inputParameters():
         type=int,
         help='テンプレートのエクスポートを区切って処理する数（デフォルト: 100）'
     )
+    processingGroup.add_argument(
+        '--host-separate',
+        '--separate-host',
+        type=int,
+        help='ホストのエクスポートを区切って処理する数（デフォルト: --template-separateと同じ）'
+    )
+    processingGroup.add_argument(
+        '--separate-min',
+        type=int,
+        help='区切って処理する数の自動調整の最小値（デフォルト: 1）'
+    )
+    processingGroup.add_argument(
+        '--separate-max',
+        type=int,
+        help='区切って処理する数の自動調整の最大値（デフォルト: 1000）'
+    )
+    processingGroup.add_argument(
+        '--separate-bytes',
+        type=int,
+        help='区切って処理する1回のデータ量の目標値（デフォルト: 8388608）'
+    )
+    processingGroup.add_argument(
+        '--separate-sec',
+        type=float,
+        help='区切って処理する1回の応答時間の目標値（デフォルト: 30）'
+    )
     processingGroup.add_argument(
         '--checknow-execute',
         '--execute-checknow',
@@ -6389,6 +8516,21 @@ def inputParameters():
         type=int,
         help='ホスト追加の並列実行を行う数（デフォルト: 4）'
     )
+    processingGroup.add_argument(
+        '--api-worker-num',
+        type=int,
+        help='Zabbixからのデータ取得の並列実行を行う数（デフォルト: --php-worker-numと同じ）'
+    )
+    processingGroup.add_argument(
+        '--api-batch-size',
+        type=int,
+        help='API実行（create/update/delete）で配列にまとめる数（デフォルト: 100）'
+    )
+    processingGroup.add_argument(
+        '--host-batch-size',
+        type=int,
+        help='ホスト適用（host.create/update）で配列にまとめる数（デフォルト: --api-batch-sizeと同じ）'
+    )
     storeGroup = parser.add_argument_group('Store Settings')
     storeGroup.add_argument(
         '-s', '--store-type',
@@ -6414,12 +8556,27 @@ def inputParameters():
     storeGroup.add_argument(
         '-sl', '--store-limit',
         type=int,
-        help='ストアの処理分離数、dydb(default: 10)'
+        help='ストアの処理分離数、redis(default: 1000)、dydbは非推奨で無視（dydb_retries/dydb_wcuを使う）'
     )
     storeGroup.add_argument(
         '-sw', '--store-interval',
         type=int,
-        help='ストアの処理分離時のインターバル秒数、dydb(default: 2)'
+        help='ストアの処理分離時のインターバル秒数、dydbは非推奨で無視（dydb_backoff_max/dydb_wcuを使う）'
+    )
+    storeGroup.add_argument(
+        '--store-codec',
+        choices=list(ZabbixCloneCodec.CODECS.keys()),
+        help=f'ストアのデータの圧縮形式、zstd/lz4はモジュールが必要(default: {ZC_DEFAULT_CODEC})'
+    )
+    storeGroup.add_argument(
+        '--store-codec-level',
+        type=int,
+        help='ストアのデータの圧縮レベル(default: 圧縮形式ごとのデフォルト)'
+    )
+    storeGroup.add_argument(
+        '--store-codec-dict',
+        choices=['YES', 'NO'],
+        help='バージョンごとに学習した辞書でアイテムを圧縮する、redis/dydbのみ(default: NO)'
     )
     '''
     storeGroup.add_argument(
@@ -6580,6 +8737,8 @@ def main():
         functions += [
             # 現在適用バージョンを記録
             ['setVersionCode', None],
+            # 適用後の状態のハッシュ値を記録
+            ['setDigestCode', None],
         ]
 
         for function in functions:
@@ -6618,6 +8777,9 @@ def main():
                 PRINT_PROG(f'{end.upper()}\n', config.quiet)
             else:
                 PRINT_PROG(f'{TAB*2}{output.upper()}\n', config.quiet)
+            if node.UPTODATE:
+                # 前回の適用から変更がないので以降の処理はしない
+                break
         PRINT_PROG('\n', config.quiet)
         LOGGER.info(f'[FINISH] {ZABBIX_TIME()}')
     else:
@@ -6634,7 +8796,7 @@ def main():
             result = node.getVersionFromStore()
             if not result[0]:
                 sys.exit(result[1])
-        if command in ['showdata', 'delete']:
+        if command in ['showdata', 'delete', 'benchmark']:
             # DATA取得実行
             if config.directMaster:
                 result = node.getDataFromMaster()
@@ -6642,13 +8804,18 @@ def main():
                 if not result[0]:
                     sys.exit(result[1])
             else:
+                if command == 'benchmark' and not params.get('version'):
+                    # ベンチマークはバージョン指定がなければ最新
+                    if not node.VERSIONS:
+                        sys.exit(f'{command} No Exist Version.')
+                    params['version'] = node.VERSIONS[0]['VERSION_ID']
                 if not params.get('version'):
                     sys.exit(f'{command} Required --version.')
                 result = node.getVersionFromStore(params['version'])
                 if not result[0]:
                     sys.exit(result[1])
                 target = result[1][0]
-                result = node.getDataFromStore(target)
+                result = node.getDataFromStore(target, methods=targetMethod, names=targetName, idOnly=idOnly)
                 if not result[0]:
                     sys.exit(result[1])
                 if isinstance(result[1], list):
@@ -6672,7 +8839,7 @@ def main():
                     unixtime = ver['UNIXTIME']
                     print(f'{TAB}{vId}: {unixtime}')
                 else:
-                    output = json.dumps(ver, indent=TAB)
+                    output = json.dumps({key: val for key, val in ver.items() if key != 'DIGEST'}, indent=TAB)
                     print(f'{TAB}' + output.replace('\n', f'\n{TAB}'))
                     print(f'{TAB}{BD}')
         elif command == 'showdata':
@@ -6690,6 +8857,50 @@ def main():
                                 output = json.dumps(item, indent=TAB)
                                 print(f'{TAB}' + output.replace('\n', f'\n{TAB}'))
                                 print(f'{TAB}{BD}')
+        elif command == 'benchmark':
+            # ストアごとの圧縮単位のJSONで各圧縮形式を比較する
+            # Redis/DynamoDB: アイテムごとのDATA、ファイル: バージョン全体（single）、メソッドごとfile_shard_items件ずつ（shard）
+            benchStore = {
+                method: [
+                    {key: value for key, value in item.items() if key != 'METHOD'}
+                        for item in items if not targetName or item['NAME'] in targetName
+                ]
+                    for method, items in store.items() if not targetMethod or method in targetMethod
+            }
+            shardItems = max(1, int(config.storeConnect.get('file_shard_items', ZC_FILE_SHARD_ITEMS)))
+            benchmarks = [
+                (
+                    'per item (redis/dydb)',
+                    [json.dumps(item['DATA'], ensure_ascii=False).encode() for values in benchStore.values() for item in values],
+                    True
+                ),
+                (
+                    'whole version (file single)',
+                    [json.dumps(benchStore, ensure_ascii=False).encode()],
+                    False
+                ),
+                (
+                    f'{shardItems} items shard (file shard)',
+                    [
+                        json.dumps(values[start:start + shardItems], ensure_ascii=False).encode()
+                            for values in benchStore.values() for start in range(0, len(values), shardItems)
+                    ],
+                    False
+                ),
+            ]
+            if not benchmarks[0][1]:
+                sys.exit(f'{command} No Exist Data.')
+            levels = {} if config.storeCodecLevel is None else {config.storeCodec: config.storeCodecLevel}
+            for label, blobs, dictionary in benchmarks:
+                size = sum([len(blob) for blob in blobs]) / 1024 / 1024
+                title = f'Codec Benchmark {label}: {len(blobs)} blobs, {size:.2f}MB '
+                print(f'{title}{B_CHAR*(WIDE_COUNT-len(title))}')
+                for row in ZabbixCloneCodec.benchmark(blobs, levels=levels, dictionary=dictionary):
+                    print(
+                        '{}{:<9} level {:>2}: ratio {:6.2f}, compress {:8.1f}MB/s, decompress {:8.1f}MB/s'.format(
+                            TAB, row['CODEC'], row['LEVEL'], row['RATIO'], row['COMPRESS'], row['DECOMPRESS']
+                        )
+                    )
         elif command == 'delete':
             print('未実装')
         elif command == 'clearstore':